@@ -0,0 +1,1267 @@
+# -*- coding: utf-8 -*-
+"""Implementation of my_python.models, imported on first use of any of its names.
+
+Importing this module imports TensorFlow, but has no other side effects: no output, 
+no global Keras settings (floatx is the Keras default float32) and the learning rate 
+schedules `lr_warmup` and `lr_inv_time_decay` are built on first access.
+"""
+
+import contextlib
+import os
+
+import tensorflow as tf # works with 2.4
+
+import numpy as np
+
+from tensorflow import keras
+from tensorflow.keras import layers
+
+# constants shared with the lazy front end my_python.models
+from my_python.models import STEPS_PER_EPOCH, BATCH_SIZE, EPOCHS
+
+real_type = tf.float32
+
+"""## Precision
+
+Models are built in float32 by default. Mixed precision builds the layers with the Keras policy `mixed_bfloat16` (matmuls in bfloat16 on CPUs with AVX-512 BF16/AMX, variables in float32) or `mixed_float16` (GPUs). The output layers `y_pred` and `dydx_pred` always compute in float32, such that both losses, in particular the L2 scaled derivative loss, are accumulated in float32.
+"""
+
+PRECISIONS = ('float32', 'mixed_bfloat16', 'mixed_float16')
+
+# Keras dtype policy for the layers built in the context, the global policy is restored on exit
+@contextlib.contextmanager
+def precision_policy(precision=None):
+    precision = precision or 'float32'
+    if precision not in PRECISIONS:
+        raise ValueError("precision must be one of %s" % (PRECISIONS,))
+    previous = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy(precision)
+    try:
+        yield
+    finally:
+        tf.keras.mixed_precision.set_global_policy(previous)
+
+
+
+"""## Build the model
+
+"""
+
+class AutodiffLayer(tf.keras.layers.Layer):
+    def __init__(self, fwd_model, **kwargs):
+      super(AutodiffLayer, self).__init__(**kwargs)
+      self.units = None
+      self.fwd_model = fwd_model # weights of ref layer 'collected' by tensorflow
+    
+    def call(self, input):
+        with tf.GradientTape(watch_accessed_variables=False) as tape:
+            tape.watch(input)
+            pred_value = self.fwd_model(input)
+           
+        # Get the gradients of the loss w.r.t to the pricing inputs
+        gradient = tape.gradient(pred_value, input)
+        # in the layer dtype, float32 for the output layer of mixed precision models
+        gradient = tf.cast(gradient, self.compute_dtype)
+
+        return gradient
+    
+    def get_config(self):
+        config = super(AutodiffLayer, self).get_config()
+        config.update({"fwd_model": self.fwd_model})
+        return config
+
+class Autoencoder(tf.keras.layers.Layer):
+    def __init__(self, input_dim, latent_dim, **kwargs):
+        super(Autoencoder, self).__init__(**kwargs)
+        self.latent_dim = min(latent_dim, input_dim)   
+        self.encoder = tf.keras.Sequential([
+            layers.Input(shape=(input_dim,)),
+            # layers.Dense(20,  kernel_initializer='glorot_normal', activation = 'linear'),
+            layers.Dense(latent_dim,  kernel_initializer='glorot_normal', activation = 'linear'),
+        ])
+        self.decoder = tf.keras.Sequential([
+            # layers.Dense(20,  kernel_initializer='glorot_normal', activation = 'linear'),
+            layers.Dense(input_dim,  kernel_initializer='glorot_normal', activation = 'linear'),
+            # layers.Dense(1,  activation = 'softplus'),
+        ])
+
+    def call(self, x):
+        encoded = self.encoder(x)
+        decoded = self.decoder(encoded)
+        return decoded
+
+    def get_config(self):
+        config = super(Autoencoder, self).get_config()
+        config.update({"latent_dim": self.latent_dim})
+        return config
+
+"""### Model A: Twin net with custom backpropagation layer"""
+
+# derivatives of the activations in terms of the pre-activation z, for the backprop of the twin net
+ACTIVATION_DERIVATIVES = {
+    'softplus': tf.math.sigmoid,
+    'sigmoid': lambda z: tf.math.sigmoid(z) * (1.0 - tf.math.sigmoid(z)),
+    'tanh': lambda z: 1.0 - tf.math.tanh(z) ** 2,
+    'swish': lambda z: tf.math.sigmoid(z) * (1.0 + z * (1.0 - tf.math.sigmoid(z)))
+}
+
+class BackpropDense(tf.keras.layers.Layer):
+    def __init__(self, reference_layer, activation='softplus', **kwargs):
+      super(BackpropDense, self).__init__(**kwargs)
+      self.units = None
+      self.ref_layer = reference_layer # weights of ref layer 'collected' by tensorflow
+      self.activation = activation
+      self.derivative = ACTIVATION_DERIVATIVES[activation]
+    
+    def call(self, gradient, z):
+        # kernel in the compute dtype of this layer, the reference layer may differ in mixed precision
+        kernel = tf.cast(self.ref_layer.kernel, gradient.dtype)
+        # transposed kernel read by the matmul, no transpose op per step
+        if z is not None:
+            # essential backprop equation
+            gradient = tf.matmul(gradient, kernel, transpose_b=True) * self.derivative(tf.cast(z, gradient.dtype))
+        else:
+            gradient = tf.matmul(gradient, kernel, transpose_b=True)
+        return gradient
+    
+    def get_config(self):
+        config = super(BackpropDense, self).get_config()
+        config.update({"reference_layer": self.ref_layer, "activation": self.activation})
+        return config
+
+"""### Second-order differentials
+
+Hessian-vector products of the network by forward-mode differentiation of the backpropagation, written out like the twin net: the forward pass carries tangents `dz = v @ W` through the layers and the backward pass differentiates `gradient * sigmoid(z)` to `dgradient * sigmoid(z) + gradient * sigmoid'(z) * dz`. A batch of directions (the unit vectors for the diagonal) is one vectorised pass of matmuls, no nested gradient tapes.
+
+The functions work on all models of the factory below (twin net and autodiff, with or without autoencoder), in the scaled coordinates of the model. `predict_gamma_unscaled` maps to raw inputs and prices: with `x_scaled = x @ W + b` and `y = y_scaled * stdY + muY` the raw Hessian is `stdY * W H W^T`.
+"""
+
+# second derivatives of the activations in terms of the pre-activation z
+ACTIVATION_SECOND_DERIVATIVES = {
+    'softplus': lambda z: tf.math.sigmoid(z) * (1.0 - tf.math.sigmoid(z)),
+    'sigmoid': lambda z: tf.math.sigmoid(z) * (1.0 - tf.math.sigmoid(z)) * (1.0 - 2.0 * tf.math.sigmoid(z)),
+    'tanh': lambda z: -2.0 * tf.math.tanh(z) * (1.0 - tf.math.tanh(z) ** 2),
+    'swish': lambda z: tf.math.sigmoid(z) * (1.0 - tf.math.sigmoid(z)) * (2.0 + z * (1.0 - 2.0 * tf.math.sigmoid(z)))
+}
+
+# dense layers of a model in the order of evaluation with a flag for the activation:
+# encoder and decoder (linear), FWD_L1, ... (activated) and y_pred (linear)
+def _layer_stack(model):
+    names = [layer.name for layer in model.layers]
+    stack = []
+    if 'auto_encoder' in names:
+        auto_encoder = model.get_layer('auto_encoder')
+        stack += [(layer, False) for layer in auto_encoder.encoder.layers + auto_encoder.decoder.layers]
+    hidden = sorted((name for name in names if name.startswith('FWD_L')), key=lambda name: int(name[5:]))
+    stack += [(model.get_layer(name), True) for name in hidden]
+    return stack + [(model.get_layer('y_pred'), False)]
+
+# activation of the hidden layers, separate layers in the twin net
+def _activation_name(model):
+    names = [layer.name for layer in model.layers]
+    layer = model.get_layer('Act_1') if 'Act_1' in names else model.get_layer('FWD_L1')
+    name = layer.activation.__name__
+    return 'swish' if name == 'silu' else name
+
+# first derivatives (kxn) and Hessian-vector products (kxdxn) for inputs x (kxn) 
+# and directions (dxn), the same for all samples, or (kxdxn)
+def second_order(x, stack, activation, directions):
+
+    derivative = ACTIVATION_DERIVATIVES[activation]
+    second_derivative = ACTIVATION_SECOND_DERIVATIVES[activation]
+
+    # feedforward with tangents, pre-activations and their tangents kept for the backprop
+    a = x
+    t = directions if directions.shape.rank == 3 else directions[tf.newaxis]
+    pres = []
+    for layer, activated in stack[:-1]:
+        kernel = tf.cast(layer.kernel, x.dtype)
+        z = tf.matmul(a, kernel) + tf.cast(layer.bias, x.dtype)
+        dz = tf.einsum('kdi,io->kdo', t, kernel)
+        pres.append((z, dz) if activated else None)
+        if activated:
+            a, t = tf.keras.activations.get(activation)(z), derivative(z)[:, tf.newaxis, :] * dz
+        else:
+            a, t = z, dz
+
+    # backprop of the gradient and its tangent, no tangent from the output layer
+    output = tf.cast(stack[-1][0].kernel, x.dtype)
+    gradient = tf.matmul(tf.ones_like(a[:, :1]), output, transpose_b=True)
+    dgradient = tf.zeros_like(t[..., :1]) * gradient[:, tf.newaxis, :]
+    for (layer, activated), pre in zip(reversed(stack[:-1]), reversed(pres)):
+        kernel = tf.cast(layer.kernel, x.dtype)
+        if activated:
+            z, dz = pre
+            dgradient = (dgradient * derivative(z)[:, tf.newaxis, :] 
+                         + (gradient * second_derivative(z))[:, tf.newaxis, :] * dz)
+            gradient = gradient * derivative(z)
+        gradient = tf.matmul(gradient, kernel, transpose_b=True)
+        dgradient = tf.einsum('kdo,io->kdi', dgradient, kernel)
+
+    return gradient, dgradient
+
+# Hessian times v (kxn) per sample
+def hessian_vector_product(model, x, v):
+    x = tf.convert_to_tensor(x, dtype=tf.float32)
+    v = tf.convert_to_tensor(v, dtype=tf.float32)
+    _, hv = second_order(x, _layer_stack(model), _activation_name(model), v[:, tf.newaxis, :])
+    return hv[:, 0, :]
+
+# Hessians (kxnxn)
+def hessian(model, x):
+    x = tf.convert_to_tensor(x, dtype=tf.float32)
+    _, h = second_order(x, _layer_stack(model), _activation_name(model), tf.eye(x.shape[-1]))
+    return h
+
+# diagonals of W H W^T (kxd) for directions W (dxn), the Hessian diagonal for W = I
+def hessian_diagonal(model, x, directions=None):
+    x = tf.convert_to_tensor(x, dtype=tf.float32)
+    directions = tf.eye(x.shape[-1]) if directions is None else tf.convert_to_tensor(directions, dtype=tf.float32)
+    _, h = second_order(x, _layer_stack(model), _activation_name(model), directions)
+    return tf.reduce_sum(h * directions, axis=-1)
+
+# unscaled gammas d2y/dx_i^2 (kxn) for raw inputs (kxn)
+def predict_gamma_unscaled(model, prep_layer, x_unscaled):
+    W, _ = prep_layer.x_affine()
+    scale, _ = prep_layer.y_affine()
+    diagonal = hessian_diagonal(model, prep_layer(x_unscaled), np.asarray(W, dtype=np.float32))
+    return diagonal.numpy() * np.asarray(scale).reshape(-1)
+
+# second-order output of the model factory: the Hessian diagonal in the coordinates of the model (directions None),
+# the labels of train_model, see prep_layer.d2ydx2Scaled, or the diagonal of W H W^T for fixed directions W (dxn), 
+# e.g. the prep layer kernel of x_affine for gammas in raw coordinates
+class HessianDiagonal(tf.keras.layers.Layer):
+    def __init__(self, reference_stack, activation='softplus', directions=None, **kwargs):
+        super(HessianDiagonal, self).__init__(**kwargs)
+        self.ref_stack = reference_stack # weights of ref layers 'collected' by tensorflow
+        self.activation = activation
+        self.directions = None if directions is None else np.asarray(directions, dtype=np.float32)
+
+    def call(self, x):
+        x = tf.cast(x, self.compute_dtype)
+        directions = tf.eye(x.shape[-1], dtype=x.dtype) if self.directions is None else tf.constant(self.directions, dtype=x.dtype)
+        _, h = second_order(x, self.ref_stack, self.activation, directions)
+        return tf.reduce_sum(h * directions, axis=-1)
+
+    def get_config(self):
+        config = super(HessianDiagonal, self).get_config()
+        config.update({"reference_stack": self.ref_stack, "activation": self.activation, 
+                       "directions": None if self.directions is None else self.directions.tolist()})
+        return config
+
+"""### Model factory
+
+One builder for all models: a feedforward stack of `depth` hidden Dense layers of `width` units, optionally behind a linear autoencoder with `latent_dim` latent variables, with the derivatives either by the explicit backpropagation of the twin net or by autodiff. The hidden layers are named `FWD_L1`, ..., the output layer `y_pred` and the derivative output `dydx_pred` in all models. The models of the paper are special cases, see below.
+
+With `second_order_output` the models have a third output `d2ydx2_pred`, the Hessian diagonal in the scaled inputs (`True`), which `train_model` fits to second-order labels mapped by the prep layer, or the diagonal of `W H W^T` for directions `W`, for training on labels in other coordinates with `model.fit`.
+
+`model_cost` reports the number of parameters and the floating point operations per sample for a configuration, e.g. to pick the cheapest model meeting an error target.
+"""
+
+DERIVATIVES = ('twin_net', 'autodiff')
+
+# hidden layers FWD_L1, ..., FWD_L<depth> and output layer y_pred,
+# activation applied inside the layers (autodiff) or separately (twin net, which needs the pre-activations)
+def _dense_stack(depth, width, activation=None):
+    hidden = [layers.Dense(width, kernel_initializer='glorot_normal', activation=activation, name='FWD_L%d' % (i + 1))
+              for i in range(depth)]
+    output = layers.Dense(1, kernel_initializer='glorot_normal', activation='linear', name='y_pred', dtype='float32')
+    return hidden, output
+
+def get_model(input_dim, depth=4, width=20, activation='softplus', latent_dim=None, derivatives='twin_net', name=None,
+              second_order_output=None):
+
+    if derivatives not in DERIVATIVES:
+        raise ValueError("derivatives must be one of %s" % (DERIVATIVES,))
+    if (derivatives == 'twin_net' or second_order_output is not None) and activation not in ACTIVATION_DERIVATIVES:
+        raise ValueError("twin net and second order require one of the activations %s" % (tuple(ACTIVATION_DERIVATIVES),))
+
+    input_1 = layers.Input(shape=(input_dim,))
+    x = input_1
+    if latent_dim is not None:
+        auto_encoder = Autoencoder(input_dim, latent_dim, name='auto_encoder')
+        x = auto_encoder(x)
+
+    if derivatives == 'autodiff':
+
+        # feedforward
+        hidden, output = _dense_stack(depth, width, activation)
+        for layer in hidden:
+            x = layer(x)
+        y_pred = output(x)
+
+        fwd_model = tf.keras.models.Model(inputs=input_1, outputs=y_pred)
+
+        # autodiff
+
+        dydx_pred = AutodiffLayer(fwd_model, name='dydx_pred', dtype='float32')(input_1)
+
+        return tf.keras.models.Model(inputs=input_1, outputs=[y_pred, dydx_pred] + _second_order_output(
+            input_1, auto_encoder if latent_dim is not None else None, hidden, output, activation, second_order_output),
+            name=name or 'Autodiff')
+
+    # feedforward
+
+    # apply activation function on input to preceeding layer, we need non-activated output for backprop
+    hidden, output = _dense_stack(depth, width)
+    zs = []
+    for i, layer in enumerate(hidden):
+        if zs:
+            x = layers.Activation(activation, name="Act_%d" % i)(zs[-1])
+        zs.append(layer(x))
+    y_pred = output(layers.Activation(activation, name="Act_%d" % depth)(zs[-1]))
+
+    # backprop
+
+    # backprop has no trainable weights, only references to layers in forward net
+    grad = tf.ones_like(y_pred)
+    refs = [output] + hidden[::-1]
+    for i, (layer, z) in enumerate(zip(refs[:-1], zs[::-1])):
+        grad = BackpropDense(layer, activation, name='Bck_L%d' % (i + 1))(grad, z)
+    if latent_dim is None:
+        dydx_pred = BackpropDense(hidden[0], activation, name='dydx_pred', dtype='float32')(grad, None)
+    else:
+        # linear autoencoder, backprop through decoder and encoder
+        grad = BackpropDense(hidden[0], activation, name='Bck_L%d' % (depth + 1))(grad, None)
+        grad = BackpropDense(auto_encoder.decoder.layers[0], activation, name='Bck_Decoder')(grad, None)
+        dydx_pred = BackpropDense(auto_encoder.encoder.layers[0], activation, name='dydx_pred', dtype='float32')(grad, None)
+
+    return tf.keras.models.Model(inputs=input_1, outputs=[y_pred, dydx_pred] + _second_order_output(
+        input_1, auto_encoder if latent_dim is not None else None, hidden, output, activation, second_order_output),
+        name=name or 'Twin_Net')
+
+# [d2ydx2_pred] for second_order_output True (Hessian diagonal) or directions, [] for None
+def _second_order_output(input_1, auto_encoder, hidden, output, activation, second_order_output):
+    if second_order_output is None or second_order_output is False:
+        return []
+    stack = [] if auto_encoder is None else [(layer, False) for layer in auto_encoder.encoder.layers + auto_encoder.decoder.layers]
+    stack += [(layer, True) for layer in hidden] + [(output, False)]
+    directions = None if second_order_output is True else second_order_output
+    return [HessianDiagonal(stack, activation, directions, name='d2ydx2_pred', dtype='float32')(input_1)]
+
+# parameters and floating point operations per sample (multiply-add as 2 operations, 
+# activations and their derivatives as 1 per unit), for the value and for the derivatives
+def model_cost(input_dim, depth=4, width=20, latent_dim=None, derivatives='twin_net'):
+
+    dims = [input_dim]
+    if latent_dim is not None:
+        dims += [latent_dim, input_dim]
+    dims += [width] * depth + [1]
+    shapes = list(zip(dims[:-1], dims[1:]))
+
+    parameters = sum(n_in * n_out + n_out for n_in, n_out in shapes)
+    matmuls = sum(2 * n_in * n_out for n_in, n_out in shapes)
+    flops_value = matmuls + sum(n_out for n_in, n_out in shapes) + depth * width
+    # backprop: transposed matmuls (none for the bias-free output gradient of ones) and the 
+    # activation derivatives times the gradient, autodiff performs the same operations on the tape
+    flops_derivatives = matmuls - 2 * width + 2 * depth * width
+
+    return {
+        'input_dim': input_dim,
+        'depth': depth,
+        'width': width,
+        'latent_dim': latent_dim,
+        'derivatives': derivatives,
+        'parameters': parameters,
+        'flops_value': flops_value,
+        'flops_derivatives': flops_derivatives,
+        'flops': flops_value + flops_derivatives
+    }
+
+"""### Model A: Twin net"""
+
+def get_model_twin_net(input_dim):
+    return get_model(input_dim, depth=4, width=20, activation='softplus', derivatives='twin_net', name='Twin_Net')
+
+"""### Model B: Naked Autodiff"""
+
+def get_model_autodiff(input_dim):
+    return get_model(input_dim, depth=4, width=20, activation='softplus', derivatives='autodiff', name='Autodiff_Autoencoder')
+
+"""### Custom autodiff and AE with latent dim 8"""
+
+def get_model_autodiff_AE8(input_dim):
+    return get_model(input_dim, depth=4, width=20, activation='softplus', latent_dim=8, derivatives='autodiff', name='Autodiff_AE8')
+
+"""### Custom autodiff and AE with latent dimension one"""
+
+def get_model_autodiff_AE1(input_dim):
+    return get_model(input_dim, depth=4, width=20, activation='softplus', latent_dim=1, derivatives='autodiff', name='Autodiff_AE1')
+
+
+"""### Learning rate schedules
+
+The original warm-up schedule interpolates the learning rate on a pre-defined grid. The main feature is a steep warm-up in the learning rate at the first epochs.
+
+The schedule is evaluated in closed form in the graph: with the training progress `t = step / (epochs * steps_per_epoch)` the learning rate is the linear interpolation on the segment containing `t`,
+
+    lr(t) = values[i] + (values[i+1] - values[i]) * (t - boundaries[i]) / (boundaries[i+1] - boundaries[i])   for boundaries[i] <= t < boundaries[i+1],
+
+selected by a mask over all segments, i.e. no precomputed table, no gather and no Python control flow on tensors (XLA-compatible). After the last boundary the learning rate stays at `values[-1]`. The original schedule is calibrated to 100 epochs; `epochs` stretches it to any training length.
+"""
+
+
+class WarmUpSchedule(tf.optimizers.schedules.LearningRateSchedule):
+    def __init__(self,
+                 steps_per_epoch,
+                 epochs = 100, # original schedule calibrated to 100 epochs
+                 boundaries = (0.0, 0.2, 0.6, 0.9, 1.0),
+                 values = (1e-08, 0.1, 0.01, 1e-06, 1e-08),
+                 name = None):
+        super(WarmUpSchedule, self).__init__()
+        if len(boundaries) != len(values) or len(boundaries) < 2:
+            raise ValueError("boundaries and values must have the same length of at least 2")
+        if any(b1 <= b0 for b0, b1 in zip(boundaries[:-1], boundaries[1:])):
+            raise ValueError("boundaries must be strictly increasing")
+        self.steps_per_epoch = steps_per_epoch
+        self.epochs = epochs
+        self.boundaries = tuple(float(b) for b in boundaries)
+        self.values = tuple(float(v) for v in values)
+        self.name = name
+        self.ms = epochs * steps_per_epoch
+
+    def __call__(self, step):
+        with tf.name_scope(self.name or 'WarmUpSchedule'):
+            boundaries = np.asarray(self.boundaries)
+            values = np.asarray(self.values)
+            # segment starts, ends (last one open), inverse widths, start values and increments as constants
+            starts = tf.constant(boundaries[:-1], dtype=tf.float32)
+            ends = tf.constant(np.append(boundaries[1:-1], np.inf), dtype=tf.float32)
+            inv_widths = tf.constant(1.0 / np.diff(boundaries), dtype=tf.float32)
+            start_values = tf.constant(values[:-1], dtype=tf.float32)
+            increments = tf.constant(np.diff(values), dtype=tf.float32)
+            # progress clipped to the grid, constant values[0] before and values[-1] after
+            t = tf.clip_by_value(tf.cast(step, tf.float32) / float(self.ms), boundaries[0], boundaries[-1])
+            segment = tf.logical_and(t >= starts, t < ends)
+            lerp = start_values + increments * ((t - starts) * inv_widths)
+            return tf.reduce_sum(tf.where(segment, lerp, tf.zeros_like(lerp)))
+
+    def get_config(self):
+        return {
+            'steps_per_epoch': self.steps_per_epoch,
+            'epochs': self.epochs,
+            'boundaries': self.boundaries,
+            'values': self.values,
+            'name': self.name
+        }
+
+# default schedules lr_warmup and lr_inv_time_decay built on first access, see __getattr__ below
+def _lr_warmup():
+    return WarmUpSchedule(STEPS_PER_EPOCH)
+
+"""A standard *inverse time decay* schedule is provided as an alternative. The initial learning rate is calibrated on the basket option discussed later."""
+
+def _lr_inv_time_decay():
+    return tf.keras.optimizers.schedules.InverseTimeDecay(
+        0.01,
+        decay_steps=STEPS_PER_EPOCH*100,
+        decay_rate=50,
+        staircase=False)
+
+_LAZY_SCHEDULES = {
+    'lr_warmup': _lr_warmup,
+    'lr_inv_time_decay': _lr_inv_time_decay
+}
+
+def _schedule(name):
+    if name not in globals():
+        globals()[name] = _LAZY_SCHEDULES[name]()
+    return globals()[name]
+
+def __getattr__(name):
+    if name in _LAZY_SCHEDULES:
+        return _schedule(name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+"""### Custom loss function
+
+Custom implementation of the MSE loss function for the differential labels. Follows the original approach to weight losses by L2 norm of differentials to level out different scales. The scale of the differentials is solely determined by the functional dependency to the price parameters.
+"""
+
+class L2ScaledMSE(keras.losses.Loss):
+# normalize ith component loss by L2 norm to level MSE contribution
+    def __init__(self, norm_weights = None, name="L2ScaleddMSE"):
+        super().__init__(name=name)
+        self.norm_weights = norm_weights
+
+    def adapt(self, dydx_train):
+        arg = tf.convert_to_tensor(dydx_train, dtype=tf.float32)
+        self.norm_weights = 1.0 / tf.reshape(tf.sqrt(tf.reduce_mean(arg ** 2 ,axis=0)),[1,-1])
+
+    # from the mean squares of the differential labels per component, e.g. MomentAccumulator.mean_square_dydx
+    def adapt_mean_square(self, mean_square):
+        arg = tf.convert_to_tensor(mean_square, dtype=tf.float32)
+        self.norm_weights = 1.0 / tf.reshape(tf.sqrt(arg),[1,-1])
+
+    @tf.function
+    def call(self, y_true, y_pred):
+        # accumulated in float32, also for mixed precision models
+        y_true, y_pred = tf.cast(y_true, tf.float32), tf.cast(y_pred, tf.float32)
+        return tf.math.reduce_mean(tf.square((y_true  - y_pred) * self.norm_weights))
+
+"""### Compile model"""
+
+
+# alpha: weight of the loss on y_pred, dydx_pred gets 1 - alpha, alpha=1 trains on values only,
+# None: 1 / (1 + differential_weight * input_dim); explicit values are used as given
+# (earlier versions replaced them by the default, e.g. alpha=1 in Illustrations.ipynb trained with 0.5)
+# jit_compile: compiles the train step with XLA, fuses the feedforward, 
+# the backprop (twin net) or inner tape (autodiff) and the loss into one CPU kernel
+# precision: 'float32' (default), 'mixed_bfloat16' or 'mixed_float16', see precision_policy
+# loss_scale: dynamic loss scaling, by default for float16 only (bfloat16 has the float32 exponent range)
+# second_order_weight: weight of the loss on d2ydx2_pred for models with second-order output,
+# defaults to the weight of the first-order loss
+# strategy: tf.distribute strategy, e.g. MultiWorkerMirroredStrategy, the model and optimizer
+# are created in its scope, see my_python.distributed
+def build_and_compile_model(
+        input_dim,
+        model_getter,
+        scaled_MSE,
+        differential_weight=1,
+        lr_schedule = None,
+        alpha = None,
+        jit_compile = False,
+        precision = None,
+        loss_scale = None,
+        second_order_weight = None,
+        strategy = None
+    ):
+
+    with (strategy.scope() if strategy is not None else contextlib.nullcontext()):
+        with precision_policy(precision):
+            model = model_getter(input_dim)
+        _compile(model, 'mse', scaled_MSE, input_dim, differential_weight, lr_schedule, alpha, jit_compile,
+                 precision, loss_scale, second_order_weight)
+
+    return model
+
+def _compile(model, y_loss, dydx_loss, input_dim, differential_weight, lr_schedule, alpha, jit_compile,
+             precision=None, loss_scale=None, second_order_weight=None):
+
+    if lr_schedule is None:
+        lr_schedule = _schedule('lr_warmup')
+
+    optimizer = tf.keras.optimizers.Adam(lr_schedule)
+    if loss_scale or (loss_scale is None and precision == 'mixed_float16'):
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+
+    if alpha is None:
+        alpha = 1.0 / (1.0 + differential_weight * input_dim)
+
+    losses = { # named losses
+                'y_pred': y_loss,
+                'dydx_pred' : dydx_loss
+            }
+    loss_weights = {'y_pred': alpha, 'dydx_pred': 1-alpha}
+    if 'd2ydx2_pred' in model.output_names:
+        losses['d2ydx2_pred'] = 'mse'
+        loss_weights['d2ydx2_pred'] = 1-alpha if second_order_weight is None else second_order_weight
+
+    # build model
+    model.compile(
+        optimizer=optimizer,
+        loss=losses,
+        run_eagerly=None,
+        loss_weights=loss_weights,
+        jit_compile=jit_compile
+    )
+
+"""## Training
+
+### Data normalization: pre- and post-processing
+
+Description of Differential PCA in Huge/Savine [Appendix 2](https://https://github.com/differential-machine-learning/appendices/blob/master/App2-Preprocessing.pdf)
+
+Code chunks of PCA courteously provided by Antoine Savine.
+
+The layers are fitted from first and second moments of the training set, which `MomentAccumulator` collects chunk by chunk (Chan et al. pairwise updates in double precision). Accumulators of different chunks or workers merge into the statistics of the full set, i.e. datasets larger than memory are pre-processed in one pass and in parallel:
+
+    stats = MomentAccumulator()
+    for x, y, dydx in generator.trainingSetChunks(m, seed=seed):
+        stats.update(x, y, dydx)
+    prep_layer, scaled_MSE = preprocess_statistics(stats, 'PCA')
+"""
+
+class MomentAccumulator:
+
+    # full: covariance of x and second moment of dydx as matrices (differential PCA),
+    # otherwise their diagonals (normalisation)
+    def __init__(self, full=True):
+        self.full = full
+        self.count = 0
+        self.mean_x = 0.0
+        self.m2_x = 0.0         # sum of centered outer products (x - mean_x)(x - mean_x)^T
+        self.mean_y = 0.0
+        self.m2_y = 0.0
+        self.mean_dydx = 0.0
+        self.sum2_dydx = 0.0    # sum of outer products dydx dydx^T (not centered)
+
+    # statistics of one chunk
+    def _moments(self, x, y, dydx):
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        dydx = np.asarray(dydx, dtype=np.float64)
+        mean_x = x.mean(axis=0)
+        x1 = x - mean_x
+        mean_y = y.mean(axis=0)
+        m2_y = ((y - mean_y) ** 2).sum(axis=0)
+        if self.full:
+            return mean_x, x1.T @ x1, mean_y, m2_y, dydx.mean(axis=0), dydx.T @ dydx
+        return mean_x, (x1 * x1).sum(axis=0), mean_y, m2_y, dydx.mean(axis=0), (dydx * dydx).sum(axis=0)
+
+    # merges the moments of count_b samples (Chan et al.)
+    def _merge(self, count_b, mean_x, m2_x, mean_y, m2_y, mean_dydx, sum2_dydx):
+        if count_b == 0:
+            return
+        count_a = self.count
+        count = count_a + count_b
+        delta_x = mean_x - self.mean_x
+        delta_y = mean_y - self.mean_y
+        outer_x = np.outer(delta_x, delta_x) if self.full else delta_x * delta_x
+        weight = count_a * count_b / count
+        self.m2_x = self.m2_x + m2_x + outer_x * weight
+        self.m2_y = self.m2_y + m2_y + delta_y * delta_y * weight
+        self.mean_x = self.mean_x + delta_x * (count_b / count)
+        self.mean_y = self.mean_y + delta_y * (count_b / count)
+        self.mean_dydx = self.mean_dydx + (mean_dydx - self.mean_dydx) * (count_b / count)
+        self.sum2_dydx = self.sum2_dydx + sum2_dydx
+        self.count = count
+
+    # adds samples, processed in chunks to bound the memory of the centered copies
+    def update(self, x, y, dydx, chunk_size=65536):
+        for start in range(0, len(x), chunk_size):
+            stop = start + chunk_size
+            self._merge(len(x[start:stop]), *self._moments(x[start:stop], y[start:stop], dydx[start:stop]))
+        return self
+
+    # adds the statistics of another accumulator, e.g. of another worker
+    def merge(self, other):
+        if other.full != self.full:
+            raise ValueError("cannot merge full and diagonal statistics")
+        self._merge(other.count, other.mean_x, other.m2_x, other.mean_y, other.m2_y, other.mean_dydx, other.sum2_dydx)
+        return self
+
+    # flat float64 vector of the statistics, e.g. for collectives across workers
+    def to_vector(self):
+        return np.concatenate([np.reshape(a, -1).astype(np.float64) for a in
+            (self.count, self.mean_x, self.m2_x, self.mean_y, self.m2_y, self.mean_dydx, self.sum2_dydx)])
+
+    @classmethod
+    def from_vector(cls, vector, n, full=True):
+        stats = cls(full)
+        size = n * n if full else n
+        shape = (n, n) if full else (n,)
+        sizes = [1, n, size, 1, 1, n, size]
+        parts = np.split(np.asarray(vector, dtype=np.float64), np.cumsum(sizes)[:-1])
+        stats.count = int(parts[0][0])
+        stats.mean_x, stats.m2_x = parts[1], parts[2].reshape(shape)
+        stats.mean_y, stats.m2_y = parts[3], parts[4]
+        stats.mean_dydx, stats.sum2_dydx = parts[5], parts[6].reshape(shape)
+        return stats
+
+    @classmethod
+    def from_chunks(cls, chunks, full=True):
+        stats = cls(full)
+        for x, y, dydx in chunks:
+            stats.update(x, y, dydx)
+        return stats
+
+    def std_y(self):
+        return np.sqrt(self.m2_y / self.count)
+
+    # covariance (or variances) of x
+    def cov_x(self):
+        return self.m2_x / self.count
+
+    # second moment E[dydx dydx^T] (or its diagonal)
+    def moment2_dydx(self):
+        return self.sum2_dydx / self.count
+
+    # mean square per column of the affine map dydx @ W + b, e.g. for L2ScaledMSE
+    def mean_square_dydx(self, W, b):
+        W = np.asarray(W, dtype=np.float64)
+        b = np.asarray(b, dtype=np.float64)
+        if self.full:
+            quadratic = np.einsum('ij,ik,kj->j', W, self.moment2_dydx(), W)
+        elif np.count_nonzero(W - np.diag(np.diagonal(W))) == 0:
+            quadratic = np.diagonal(W) ** 2 * self.moment2_dydx()
+        else:
+            raise ValueError("diagonal statistics support diagonal maps only")
+        return quadratic + 2.0 * b * (self.mean_dydx @ W) + b * b
+
+class DPCALayer(tf.keras.layers.Layer):
+    def __init__(self, **kwargs):
+        super(DPCALayer, self).__init__(**kwargs)
+
+        self.x_eig_thresh  = 1.0e-04   # filter threshold for const/redundant inputs
+        self.dx_eig_thresh = 2.0e-02   # filter threshold for zero/redundant derivatives
+
+        self.muX = 0
+        self.muY = 0 
+        self.stdY = 0
+        self.x1Tox3 = 0
+        self.x1BarTox3Bar = 0 
+        self.x3BarTox1Bar = 0
+        self.n = 0
+
+    
+    def adapt(self, x_raw, y_raw, dydx_raw):
+        self.adapt_statistics(MomentAccumulator(full=True).update(x_raw, y_raw, dydx_raw))
+
+    def adapt_chunks(self, chunks):
+        self.adapt_statistics(MomentAccumulator.from_chunks(chunks, full=True))
+
+    # fit from the moments of the training set, no pass over the data
+    def adapt_statistics(self, stats):
+        if not stats.full:
+            raise ValueError("differential PCA requires full statistics")
+
+        # basic processing (step 1 in the note)
+        
+        n0 = stats.mean_x.size
+
+        # center inputs
+        # compute, statistics accumulated in double precision
+        self.muX = stats.mean_x
+               
+        # normalize inputs
+        # compute
+        self.muY = stats.mean_y
+        self.stdY = stats.std_y()
+       
+        # update derivs: second moment of x1Bar = x0Bar / stdY
+        x1BarMoment2 = stats.moment2_dydx() / self.stdY**2
+        
+        # dim
+        n1 = n0
+                
+        # input orthonormalization and filtering (step 2 in the note)
+        
+        # eigenvalue decomposition
+        d2, p2 = np.linalg.eigh(stats.cov_x())
+        
+        # filter
+        f2 = np.argwhere(d2 > self.x_eig_thresh**2).reshape(-1)
+
+        # dim       
+        n2 = f2.size
+        if n2 == 0:
+            raise Exception("all variables were filtered out in step 2")
+        
+        # shrink eigenvalues and eigenvectors by filter
+        d2Tilde = d2[f2]
+        p2Tilde = p2[:, f2]
+        
+        # scale inputs
+        # compute
+        sqrtD2Tilde = np.sqrt(d2Tilde).reshape((1,-1))
+        x1Tox2 = p2Tilde / sqrtD2Tilde
+        
+        # update derivs
+        # compute
+        x1BarTox2Bar = p2Tilde * sqrtD2Tilde
+        x2BarTox1Bar = p2Tilde.T / sqrtD2Tilde.reshape((-1,1))
+        # derivatives orthogonalization and filtering (step 3 in the note)
+        
+        # eigenvalue decomposition
+        d3, p3 = np.linalg.eigh(x1BarTox2Bar.T @ x1BarMoment2 @ x1BarTox2Bar)
+            
+        # filter
+        f3 = np.argwhere(d3 > self.dx_eig_thresh**2).reshape(-1)
+
+        # dim       
+        n3 = f3.size
+        if n3 == 0:
+            raise Exception("all variables were filtered out in step 3")
+            
+        # shrink eigenvectors by filter
+        p3Tilde = p3[:, f3]
+            
+        # scale inputs
+        # compute
+        x2Tox3 = p3Tilde
+        
+        # update derivs
+        # compute
+        x2BarTox3Bar = p3Tilde
+        x3BarTox2Bar = p3Tilde.T
+
+        # raw to processed and back (step 4 in the note)
+    
+        # x
+        # scaling matrix
+        self.x1Tox3 = x1Tox2 @ x2Tox3
+        
+        # dx
+        # scaling
+        self.x1BarTox3Bar = x1BarTox2Bar @ x2BarTox3Bar
+        # and back
+        self.x3BarTox1Bar = x3BarTox2Bar @ x2BarTox1Bar
+
+        # dim
+        self.n = n3
+
+        # transforms in the layer dtype, data in that dtype is scaled without conversions
+        dtype = np.dtype(self.dtype)
+        self.muX, self.muY, self.stdY, self.x1Tox3, self.x1BarTox3Bar, self.x3BarTox1Bar = [
+            np.asarray(a, dtype=dtype) for a in
+            (self.muX, self.muY, self.stdY, self.x1Tox3, self.x1BarTox3Bar, self.x3BarTox1Bar)]
+
+    def call(self, inputs):
+        # layer called on x as inputs
+        return (inputs - self.muX) @ self.x1Tox3
+    
+    def yScaled(self, y):
+        return (y - self.muY) / self.stdY
+
+    def yScaledInverse(self, y):
+        return (y * self.stdY )  + self.muY
+
+    def dydxScaled(self, dydx):
+        return (dydx / self.stdY) @ self.x1BarTox3Bar
+    
+    def dydxScaledInverse(self, dydx_scaled):
+        return dydx_scaled @ self.x3BarTox1Bar * self.stdY
+
+    # Hessian diagonal in the scaled inputs, diag(D^T H D) / stdY with D = x1BarTox3Bar, from raw Hessians (kxnxn),
+    # the rotation mixes the inputs, i.e. raw diagonals (kxn) determine the scaled diagonal for n = 1 only
+    def d2ydx2Scaled(self, d2ydx2):
+        if len(d2ydx2.shape) == 2:
+            if d2ydx2.shape[-1] != 1:
+                raise ValueError("differential PCA requires full Hessians (kxnxn) as second-order labels")
+            return d2ydx2 * self.x1BarTox3Bar ** 2 / self.stdY
+        return tf.reduce_sum((d2ydx2 @ self.x1BarTox3Bar) * self.x1BarTox3Bar, axis=-2) / self.stdY
+
+    # the scaled diagonal does not determine the raw diagonal, see predict_gamma_unscaled
+    def d2ydx2ScaledInverse(self, d2ydx2_scaled):
+        raise NotImplementedError("raw gammas of a PCA model are given by predict_gamma_unscaled")
+
+    # transforms as affine maps: x_scaled = x @ W + b and y = y_scaled * scale + shift
+    def x_affine(self):
+        return self.x1Tox3, -self.muX @ self.x1Tox3
+
+    def y_affine(self):
+        return self.stdY, self.muY
+
+    # dydx = dydx_scaled @ D
+    def dydx_affine(self):
+        return self.x3BarTox1Bar * self.stdY
+
+    def output_n(self):
+        return self.n
+
+    def get_config(self):
+        config = super(DPCALayer, self).get_config()
+        return config
+
+class NormalisationLayer(tf.keras.layers.Layer):
+    def __init__(self, **kwargs):
+        super(NormalisationLayer, self).__init__(**kwargs)
+
+        self.muX = 0
+        self.muY = 0 
+        self.stdX = 0
+        self.stdY = 0
+
+        self.n = 0
+
+    def adapt(self, x_raw, y_raw, dydx_raw):
+        self.adapt_statistics(MomentAccumulator(full=False).update(x_raw, y_raw, dydx_raw))
+
+    def adapt_chunks(self, chunks):
+        self.adapt_statistics(MomentAccumulator.from_chunks(chunks, full=False))
+
+    # fit from the moments of the training set, full or diagonal
+    def adapt_statistics(self, stats):
+        # basic processing (step 1 in the note)
+        
+        self.n = stats.mean_x.size
+
+        # normalize inputs
+        # compute, statistics accumulated in double precision
+        self.muX = stats.mean_x
+        self.stdX = np.sqrt(np.diagonal(stats.cov_x()) if stats.full else stats.cov_x())
+       
+        # normalize inputs
+        # compute
+        self.muY = stats.mean_y
+        self.stdY = stats.std_y()
+
+        # statistics in the layer dtype, data in that dtype is scaled without conversions
+        dtype = np.dtype(self.dtype)
+        self.muX, self.stdX, self.muY, self.stdY = [
+            np.asarray(a, dtype=dtype) for a in (self.muX, self.stdX, self.muY, self.stdY)]
+        
+
+    def call(self, inputs):
+        # layer called on x as inputs
+        return (inputs - self.muX) /  self.stdX
+    
+    def yScaled(self, y):
+        return (y - self.muY) / self.stdY
+
+    def yScaledInverse(self, y):
+        return (y * self.stdY ) + self.muY
+
+    def dydxScaled(self, dydx):
+        return dydx * (self.stdX / self.stdY)
+    
+    def dydxScaledInverse(self, dydx_scaled):
+        return dydx_scaled * (self.stdY / self.stdX)
+
+    # Hessian diagonal in the scaled inputs from raw diagonals (kxn) or Hessians (kxnxn)
+    def d2ydx2Scaled(self, d2ydx2):
+        if len(d2ydx2.shape) == 3:
+            d2ydx2 = tf.linalg.diag_part(d2ydx2)
+        return d2ydx2 * (self.stdX ** 2 / self.stdY)
+
+    def d2ydx2ScaledInverse(self, d2ydx2_scaled):
+        return d2ydx2_scaled * (self.stdY / self.stdX ** 2)
+
+    # transforms as affine maps: x_scaled = x @ W + b and y = y_scaled * scale + shift
+    def x_affine(self):
+        return np.diag(1.0 / self.stdX), -self.muX / self.stdX
+
+    def y_affine(self):
+        return self.stdY, self.muY
+
+    # dydx = dydx_scaled @ D
+    def dydx_affine(self):
+        return np.diag(self.stdY / self.stdX)
+    
+    def output_n(self):
+        return self.n
+
+    def get_config(self):
+        config = super(NormalisationLayer, self).get_config()
+        return config
+
+class NoNormalisationLayer(tf.keras.layers.Layer):
+    def __init__(self, **kwargs):
+        super(NoNormalisationLayer, self).__init__(**kwargs)
+
+        self.n = 0
+
+    def adapt(self, x_raw, y_raw, dydx_raw):
+        # basic processing (step 1 in the note)
+        
+       
+        self.n = x_raw.shape[1] 
+
+    def adapt_chunks(self, chunks):
+        for x_raw, y_raw, dydx_raw in chunks:
+            self.adapt(x_raw, y_raw, dydx_raw)
+
+    def adapt_statistics(self, stats):
+        self.n = stats.mean_x.size
+        
+
+    def call(self, inputs):
+        # layer called on x as inputs
+        return inputs
+
+    def yScaled(self, y):
+        return y
+
+    def yScaledInverse(self, y):
+        return y
+
+    def dydxScaled(self, dydx):
+        return dydx 
+
+    def dydxScaledInverse(self, dydx_scaled):
+        return dydx_scaled 
+
+    # Hessian diagonal from raw diagonals (kxn) or Hessians (kxnxn)
+    def d2ydx2Scaled(self, d2ydx2):
+        if len(d2ydx2.shape) == 3:
+            return tf.linalg.diag_part(d2ydx2)
+        return d2ydx2
+
+    def d2ydx2ScaledInverse(self, d2ydx2_scaled):
+        return d2ydx2_scaled
+
+    # transforms as affine maps: x_scaled = x @ W + b and y = y_scaled * scale + shift
+    def x_affine(self):
+        return np.eye(self.n), np.zeros(self.n)
+
+    def y_affine(self):
+        return np.ones(1), np.zeros(1)
+
+    # dydx = dydx_scaled @ D
+    def dydx_affine(self):
+        return np.eye(self.n)
+
+    def output_n(self):
+        return self.n
+
+    def get_config(self):
+        config = super(NoNormalisationLayer, self).get_config()
+        return config
+
+def _prep_layer(input_dim, prep_type, dtype):
+    if (prep_type == 'PCA'):
+        return DPCALayer(input_shape=[input_dim,], dtype=dtype)
+    elif (prep_type == 'Normalisation'):
+        return NormalisationLayer(input_shape=[input_dim,], dtype=dtype)
+    elif (prep_type == 'NoNormalisation'):
+        return NoNormalisationLayer(input_shape=[input_dim,], dtype=dtype)
+    else:
+        print('Pre-processing unknwon. Use no normalisation instead')
+        return NormalisationLayer(input_shape=[input_dim,], dtype=dtype)
+
+# dtype of the prep layer defaults to floatx (float32)
+def preprocess_data(x_train, y_train, dydx_train, prep_type='Normalisation', dtype=None):
+    stats = MomentAccumulator(full=(prep_type == 'PCA')).update(x_train, y_train, dydx_train)
+    return preprocess_statistics(stats, prep_type, dtype)
+
+# prep layer and loss from the moments of the training set (MomentAccumulator), 
+# the differential labels are not scaled for the loss weights
+def preprocess_statistics(stats, prep_type='Normalisation', dtype=None):
+
+    prep_layer = _prep_layer(stats.mean_x.size, prep_type, dtype)
+    prep_layer.adapt_statistics(stats)
+
+    scaled_MSE = L2ScaledMSE()
+    scaled_MSE.adapt_mean_square(stats.mean_square_dydx(*prep_layer.x_affine()))
+ 
+    return prep_layer, scaled_MSE
+
+# prep layer and loss from chunks (x, y, dydx), e.g. generator.trainingSetChunks(m, seed=seed)
+def preprocess_chunks(chunks, prep_type='Normalisation', dtype=None):
+    return preprocess_statistics(MomentAccumulator.from_chunks(chunks, full=(prep_type == 'PCA')), prep_type, dtype)
+
+# predict and inverse transform   
+def predict_unscaled(model, prep_layer, x_unscaled, verbose='auto'):
+
+    y_scaled, dydx_scaled = model.predict(prep_layer(x_unscaled), verbose=verbose)
+    y_pred = prep_layer.yScaledInverse(y_scaled)
+    dydx_pred = prep_layer.dydxScaledInverse(dydx_scaled)
+    
+    return y_pred.reshape(-1,1), dydx_pred
+
+"""### Fused pre- and post-processing
+
+The transforms of the prep layers are affine maps: `x_scaled = x @ W + b`, `y = y_scaled * scale + shift` and `dydx = dydx_scaled @ D`. The fused model applies them as fixed (non-trainable) layers around the network, i.e. it maps raw inputs to unscaled price and delta in one graph and `predict`, `fit` and serving need no scaled copies of the data.
+
+Training a fused model on raw labels with `ScaledLoss` scales the labels and predictions in the graph and minimises the same objective as the network on pre-processed data (`dydx_scaled @ D` is scaled back exactly by `dydxScaled`).
+
+    model = build_and_compile_fused_model(get_model_twin_net, prep_layer, scaled_MSE)
+    train_model(model, None, train_id, x_train, y_train, dydx_train, x_true=x_true, y_true=y_true, dydx_true=dydx_true)
+    y_pred, dydx_pred = model.predict(x_test)
+"""
+
+# fixed affine map as Dense layer
+def _affine_layer(kernel, bias, name):
+    kernel = np.asarray(kernel, dtype=np.float64)
+    return layers.Dense(
+        kernel.shape[1],
+        use_bias = bias is not None,
+        kernel_initializer = tf.constant_initializer(kernel),
+        bias_initializer = tf.constant_initializer(np.zeros(kernel.shape[1]) if bias is None else np.asarray(bias, dtype=np.float64)),
+        trainable = False,
+        name = name)
+
+# raw x to unscaled (y, dydx) around a model on pre-processed data, the model is shared (not copied)
+def get_model_fused(model, prep_layer):
+
+    W, b = prep_layer.x_affine()
+    scale, shift = [np.asarray(a, dtype=np.float64).reshape(-1) for a in prep_layer.y_affine()]
+    input_dim = np.shape(W)[0]
+
+    x_raw = keras.Input(shape=(input_dim,), name='x_raw')
+    y_scaled, dydx_scaled = model(_affine_layer(W, b, 'prep_x')(x_raw))
+    y_pred = _affine_layer(scale.reshape(1, 1), shift, 'y_pred')(y_scaled)
+    dydx_pred = _affine_layer(prep_layer.dydx_affine(), None, 'dydx_pred')(dydx_scaled)
+
+    return tf.keras.models.Model(inputs=x_raw, outputs=[y_pred, dydx_pred], name=model.name + '_fused')
+
+# loss on raw labels and unscaled predictions evaluated on their scaled values, 
+# scale: prep_layer.yScaled or prep_layer.dydxScaled
+class ScaledLoss(keras.losses.Loss):
+
+    def __init__(self, loss, scale, name="ScaledLoss"):
+        super().__init__(name=name)
+        self.loss = keras.losses.get(loss)
+        self.scale = scale
+
+    def call(self, y_true, y_pred):
+        y_true, y_pred = self.scale(y_true), self.scale(y_pred)
+        if isinstance(self.loss, keras.losses.Loss):
+            return self.loss.call(y_true, y_pred)
+        return self.loss(y_true, y_pred)
+
+def build_and_compile_fused_model(
+        model_getter,
+        prep_layer,
+        scaled_MSE,
+        differential_weight=1,
+        lr_schedule = None,
+        alpha = None,
+        jit_compile = False,
+        precision = None,
+        loss_scale = None
+    ):
+
+    input_dim = prep_layer.output_n()
+    with precision_policy(precision):
+        model = model_getter(input_dim)
+    model = get_model_fused(model, prep_layer)
+    _compile(model,
+             ScaledLoss('mse', prep_layer.yScaled, name='y_scaled_mse'),
+             ScaledLoss(scaled_MSE, prep_layer.dydxScaled, name='dydx_scaled_mse'),
+             input_dim, differential_weight, lr_schedule, alpha, jit_compile, precision, loss_scale)
+
+    return model
+
+"""### Input pipeline
+
+Training data as `tf.data.Dataset` of raw `(x, y, dydx)` samples, built from arrays, from chunk generators like `Bachelier.trainingSetChunks` or from `.npz` shards. The pre-processing is mapped per batch, such that no pre-processed copy of the full training set is required and data preparation overlaps with training.
+"""
+
+# d2ydx2: second-order labels, raw Hessian diagonals (mxn) or Hessians (mxnxn), see prep_layer.d2ydx2Scaled
+def dataset_from_arrays(x, y, dydx, d2ydx2=None):
+    if d2ydx2 is not None:
+        return tf.data.Dataset.from_tensor_slices((x, y, dydx, d2ydx2))
+    return tf.data.Dataset.from_tensor_slices((x, y, dydx))
+
+# chunks: callable returning an iterator of (x, y, dydx) chunks, 
+# e.g. lambda: generator.trainingSetChunks(m, seed=seed) for identical data in every epoch
+def dataset_from_chunks(chunks, input_dim, dtype=tf.float32):
+    signature = (
+        tf.TensorSpec(shape=(None, input_dim), dtype=dtype),
+        tf.TensorSpec(shape=(None, 1), dtype=dtype),
+        tf.TensorSpec(shape=(None, input_dim), dtype=dtype)
+    )
+    return tf.data.Dataset.from_generator(chunks, output_signature=signature).unbatch()
+
+# one shard per file, shards are read in parallel 
+def dataset_from_npz(paths, keys=('x_train', 'y_train', 'dydx_train')):
+
+    def load(path):
+        with np.load(path.decode()) as shard:
+            return tuple(shard[key].astype(np.float32, copy=False) for key in keys)
+
+    def read_shard(path):
+        x, y, dydx = tf.numpy_function(load, [path], [tf.float32] * 3)
+        x.set_shape([None, None])
+        y.set_shape([None, 1])
+        dydx.set_shape([None, None])
+        return tf.data.Dataset.from_tensor_slices((x, y, dydx))
+
+    return tf.data.Dataset.from_tensor_slices([str(path) for path in paths]).interleave(
+        read_shard, num_parallel_calls=tf.data.AUTOTUNE)
+
+# raw (x, y, dydx) samples to batches of (x, [y, dydx]) in the scaled space of the prep layer
+# cache: False, True (memory) or a file name, caches raw samples, i.e. sources are read once
+def prepare_dataset(dataset, prep_layer, batch_size=1024, shuffle_buffer=None, cache=False, seed=None):
+
+    if cache is True:
+        dataset = dataset.cache()
+    elif cache:
+        dataset = dataset.cache(cache)
+    if shuffle_buffer:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+
+    # samples (x, y, dydx) or (x, y, dydx, d2ydx2) with second-order labels
+    def scale(x, y, dydx, *d2ydx2):
+        if prep_layer is None:
+            # raw data for fused models
+            return tf.cast(x, tf.float32), tuple(tf.cast(a, tf.float32) for a in (y, dydx) + d2ydx2)
+        x, y, dydx = [tf.cast(a, prep_layer.dtype) for a in (x, y, dydx)]
+        labels = (prep_layer.yScaled(y), prep_layer.dydxScaled(dydx))
+        if d2ydx2:
+            labels += (prep_layer.d2ydx2Scaled(tf.cast(d2ydx2[0], prep_layer.dtype)),)
+        return prep_layer(x), labels
+
+    return dataset.batch(batch_size).map(scale, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+
+"""### Training utility
+
+`x_train` is either an array or a `tf.data.Dataset` of raw `(x, y, dydx)` or `(x, y, dydx, d2ydx2)` samples (see input pipeline above), likewise `x_true` for validation. Fused models are trained with `prep_layer=None` on the raw data. Second-order labels `d2ydx2_train` are raw Hessian diagonals (mxn) or Hessians (mxnxn, required by PCA), mapped to the Hessian diagonal in the scaled inputs for models with `second_order_output=True`.
+"""
+
+
+
+def train_model(model,
+                prep_layer, 
+                train_id,
+                x_train, 
+                y_train, 
+                dydx_train=None,
+                epochs = EPOCHS,
+                batch_size = BATCH_SIZE,
+                x_true = None,
+                y_true = None,
+                dydx_true = None,
+                shuffle_buffer = None,
+                progress = True,
+                d2ydx2_train = None,
+                d2ydx2_true = None,
+                steps_per_epoch = None,
+                log_dir = None,
+                profile_steps = None):
+
+    callbacks = [
+                 tf.keras.callbacks.EarlyStopping(monitor='loss',patience=100)
+                 ]
+    # progress bar, e.g. off in sweep workers
+    if progress:
+        from tqdm.keras import TqdmCallback
+        callbacks.append(TqdmCallback(verbose=1))
+
+    # second-order labels are mapped to the Hessian diagonal in the scaled inputs, see prep_layer.d2ydx2Scaled
+    if d2ydx2_train is not None and prep_layer is not None \
+            and getattr(model.get_layer('d2ydx2_pred'), 'directions', None) is not None:
+        raise ValueError("second-order labels require a model with second_order_output=True, not directions")
+
+    if isinstance(x_train, tf.data.Dataset):
+        # batches come from the dataset
+        x_fit, y_fit, fit_batch_size = prepare_dataset(x_train, prep_layer, batch_size, shuffle_buffer), None, None
+    elif isinstance(x_train, tf.distribute.DistributedDataset):
+        # pre-processed batches of the workers, see my_python.distributed
+        x_fit, y_fit, fit_batch_size = x_train, None, None
+    elif prep_layer is None:
+        x_fit, y_fit, fit_batch_size = x_train, [y_train, dydx_train], batch_size
+    else:
+        x_fit, y_fit, fit_batch_size = prep_layer(x_train), [prep_layer.yScaled(y_train), prep_layer.dydxScaled(dydx_train)], batch_size
+        # second-order labels for models with d2ydx2_pred output
+        if d2ydx2_train is not None:
+            y_fit.append(prep_layer.d2ydx2Scaled(d2ydx2_train))
+
+    # no validation without a test set, e.g. in benchmarks
+    if x_true is None:
+        validation_data = None
+    elif isinstance(x_true, tf.data.Dataset):
+        validation_data = prepare_dataset(x_true, prep_layer, batch_size)
+    elif prep_layer is None:
+        validation_data = (x_true, [y_true, dydx_true])
+    else:
+        validation_data = (prep_layer(x_true), [prep_layer.yScaled(y_true), prep_layer.dydxScaled(dydx_true)])
+        if d2ydx2_true is not None:
+            validation_data[1].append(prep_layer.d2ydx2Scaled(d2ydx2_true))
+
+    # TensorBoard logs, step timing, throughput and memory under log_dir/train_id, e.g. log_dir = 'tensorboard_logs/pca',
+    # profile_steps = (start, stop): global steps traced by the TensorFlow profiler, see my_python.instrumentation
+    if log_dir is not None:
+        from my_python.instrumentation import training_callbacks
+        samples_per_epoch = len(x_fit) if fit_batch_size is not None and steps_per_epoch is None else None
+        callbacks += training_callbacks(os.path.join(log_dir, train_id or ''), batch_size, profile_steps, samples_per_epoch)
+    
+    history = model.fit(
+        x_fit, y_fit, 
+        # e.g. for repeated datasets of the workers in distributed training
+        steps_per_epoch = steps_per_epoch,
+        batch_size = fit_batch_size,
+        epochs=epochs,
+        callbacks=callbacks,
+        validation_data = validation_data,
+        verbose=0
+        )
+    return history
+
+"""## Examples of Twin Net and Autodiff AE
+
+### Impact of sample size
+"""
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks
+
+Times the stages of the pipeline over a grid of dimensions n and sample sizes m: training set generation (`Bachelier.trainingSet`), pre-processing (`DPCALayer.adapt` via `preprocess_data`), one training epoch (`train_model`) and inference (`predict_unscaled`) for the twin net and autodiff models. Every measurement records the best time of a few repeats, the throughput (paths/s, samples/s, predictions/s) and the peak memory (resident set size above the level before the stage) of a separate, untimed call.
+
+Results are written as JSON and compared against the results of another commit, a drop in throughput beyond the threshold is a regression. Stages timed with fewer than 3 repeats or faster than a millisecond are not compared:
+
+    python -m my_python.benchmark --out bench/HEAD.json
+    python -m my_python.benchmark --out bench/new.json --baseline bench/HEAD.json --threshold 0.1
+
+The full grid (n in {1, 10, 30, 100}, m from 2^10 to 2^22 in factors of 4) takes hours and about 16 GB of memory at the top end, `--n` and `--log2m` select a subset.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from my_python.generators import Bachelier
+from my_python.memory import PeakMemory
+
+DIMS = (1, 10, 30, 100)
+LOG2_SIZES = tuple(range(10, 23, 2))
+MODELS = ('get_model_twin_net', 'get_model_autodiff')
+
+# compare: fewer repeats, or stages faster than this (timer resolution and scheduling noise),
+# are not judged
+MIN_REPEATS = 3
+MIN_SECONDS = 1e-3
+
+# best time of repeats of fn() and the peak memory of a separate call, after a warm-up call (imports, tracing),
+# the timed calls run without the thread sampling the memory
+def measure(fn, repeats=3):
+    fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    with PeakMemory() as memory:
+        fn()
+    return min(times), memory.peak
+
+def _record(stage, n, m, seconds, peak, items, unit, repeats, **extra):
+    return {
+        'stage': stage, 'n': n, 'm': m, **extra,
+        'seconds': seconds,
+        'repeats': repeats,
+        'throughput': items / seconds,
+        'unit': unit,
+        'peak_mb': peak / 2**20
+    }
+
+# all stages for one (n, m), models: names of getters in my_python.models
+def bench_case(n, m, models=MODELS, repeats=3, batch_size=1024, seed=1234):
+
+    from my_python import models as models_module
+
+    results = []
+    generator = Bachelier(n).calibrate(seed=seed)
+
+    seconds, peak = measure(lambda: generator.trainingSet(m, seed=seed), repeats)
+    results.append(_record('generate', n, m, seconds, peak, m, 'paths/s', repeats))
+
+    x, y, dydx = generator.trainingSet(m, seed=seed)
+    seconds, peak = measure(lambda: models_module.preprocess_data(x, y, dydx, 'PCA'), repeats)
+    results.append(_record('adapt', n, m, seconds, peak, m, 'samples/s', repeats, prep_type='PCA'))
+    prep_layer, scaled_MSE = models_module.preprocess_data(x, y, dydx, 'PCA')
+
+    for name in models:
+        model = models_module.build_and_compile_model(
+            prep_layer.output_n(), getattr(models_module, name), scaled_MSE,
+            lr_schedule=models_module.WarmUpSchedule(max(1, m // batch_size)))
+
+        # one epoch of train_model, including the scaling of the training set and its callbacks
+        def epoch():
+            models_module.train_model(model, prep_layer, None, x, y, dydx, epochs=1, batch_size=batch_size,
+                                      progress=False)
+
+        seconds, peak = measure(epoch, repeats)
+        results.append(_record('train_epoch', n, m, seconds, peak, m, 'samples/s', repeats, model=name))
+
+        seconds, peak = measure(lambda: models_module.predict_unscaled(model, prep_layer, x, verbose=0), repeats)
+        results.append(_record('predict', n, m, seconds, peak, m, 'predictions/s', repeats, model=name))
+
+    return results
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    import tensorflow as tf
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'tensorflow': tf.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count()
+    }
+
+def run(dims=DIMS, log2_sizes=LOG2_SIZES, models=MODELS, repeats=3, log=print):
+    results = []
+    for n in dims:
+        for log2m in log2_sizes:
+            for record in bench_case(n, 2**log2m, models, repeats):
+                log('%-12s n=%-4d m=2^%-3d %-22s %12.0f %s  %8.1f MB' % (
+                    record['stage'], n, log2m, record.get('model', ''), record['throughput'], record['unit'], record['peak_mb']))
+                results.append(record)
+    return {'environment': environment(), 'results': results}
+
+def _case(record):
+    return (record['stage'], record['n'], record['m'], record.get('model'))
+
+# a best time of too few repeats or below a millisecond varies by more than the threshold between runs,
+# records without repeats (older results) are taken as measured with enough repeats, every stage processes m items
+def _reliable(record):
+    seconds = record.get('seconds', record['m'] / record['throughput'])
+    return record.get('repeats', MIN_REPEATS) >= MIN_REPEATS and seconds >= MIN_SECONDS
+
+# records of current slower than baseline by more than the threshold (relative throughput drop),
+# cases with unreliable timings in either run are skipped
+def compare(current, baseline, threshold=0.1):
+    reference = {_case(record): record for record in baseline['results']}
+    regressions = []
+    for record in current['results']:
+        base = reference.get(_case(record))
+        if base is None or not (_reliable(record) and _reliable(base)):
+            continue
+        change = record['throughput'] / base['throughput'] - 1.0
+        if change < -threshold:
+            regressions.append({**record, 'baseline_throughput': base['throughput'], 'change': change})
+    return regressions
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--out', required=True, help='JSON file for the results')
+    parser.add_argument('--baseline', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative throughput drop counted as regression')
+    parser.add_argument('--n', type=int, nargs='+', default=list(DIMS))
+    parser.add_argument('--log2m', type=int, nargs='+', default=list(LOG2_SIZES))
+    parser.add_argument('--models', nargs='+', default=list(MODELS))
+    parser.add_argument('--repeats', type=int, default=MIN_REPEATS,
+                        help='timed repeats per stage, fewer than %d are not compared' % MIN_REPEATS)
+    args = parser.parse_args(argv)
+
+    report = run(args.n, args.log2m, args.models, args.repeats)
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for record in regressions:
+            print('REGRESSION %-12s n=%-4d m=%-8d %-22s %+.1f%%' % (
+                record['stage'], record['n'], record['m'], record.get('model') or '', 100 * record['change']))
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
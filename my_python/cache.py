@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""Dataset cache
+
+Disk cache in front of the generator methods. Entries are keyed on the generator class, its parameters and state (e.g. the cached Bachelier market), the method and its arguments including the seed. Repeated calls return memory-mapped arrays from the cache instead of re-simulating.
+
+    cache = DatasetCache('~/.cache/differential-ml', max_bytes=2**34)
+    x_train, y_train, dydx_train = cache(generator, 'trainingSet', 2**20, seed=1234)
+
+Calls without seed (positional or keyword), or with a stateful rng on the generator or in the call, are not reproducible and bypass the cache, as do the chunked methods (`trainingSetChunks`, consumed lazily) and results other than tuples of arrays. Entries are plain `.npy`, `.npz` and JSON files read without pickle. The cache is limited in size with least recently used entries evicted first.
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+
+import numpy as np
+
+from my_python import datasets
+
+STATE_FILE = 'state.json'
+STATE_ARRAYS = 'state.npz'
+
+# array names of the results by method, the second-order labels of gamma=True last,
+# other methods store array_0, array_1, ...
+RESULT_KEYS = {
+    'trainingSet': datasets.TRAIN_KEYS + ('d2ydx2_train',),
+    'trainingSetUniformS1': datasets.TRAIN_KEYS + ('d2ydx2_train',),
+    'trainingSetParallel': datasets.TRAIN_KEYS,
+    'trainingSetUniformS1Parallel': datasets.TRAIN_KEYS,
+    'testSet': datasets.TEST_KEYS + ('gammas',)
+}
+
+# denseZ=False: S1, C2, w and the basket weights a with dC2/dS1 = w * a, the labels g of gamma=True last
+SPARSE_TRAIN_KEYS = ('x_train', 'y_train', 'w_train', 'a', 'g_train')
+
+def _result_keys(method, arguments, n):
+    keys = SPARSE_TRAIN_KEYS if arguments.get('denseZ') is False else RESULT_KEYS.get(method, ())
+    return keys[:n] if len(keys) >= n else tuple('array_%d' % i for i in range(n))
+
+# generator state without pickle: arrays to an .npz, dtypes by name and plain values to JSON,
+# loading an entry never executes code from the (possibly shared) cache directory
+def _save_state(path, generator):
+    arrays, plain = {}, {}
+    for key, value in vars(generator).items():
+        if key == 'rng':
+            continue
+        if isinstance(value, np.ndarray):
+            arrays[key] = value
+        elif isinstance(value, np.dtype):
+            plain[key] = {'__dtype__': value.str}
+        elif isinstance(value, np.generic):
+            plain[key] = value.item()
+        else:
+            plain[key] = value
+    # TypeError for state which is not plain
+    text = json.dumps(plain)
+    np.savez(path / STATE_ARRAYS, **arrays)
+    with open(path / STATE_FILE, 'w') as f:
+        f.write(text)
+
+def _load_state(path):
+    with open(path / STATE_FILE) as f:
+        state = {key: np.dtype(value['__dtype__']) if isinstance(value, dict) and '__dtype__' in value else value
+                 for key, value in json.load(f).items()}
+    with np.load(path / STATE_ARRAYS, allow_pickle=False) as f:
+        state.update({key: f[key] for key in f.files})
+    return state
+
+# representation of a value which is the same in every process: functions and classes by module and
+# qualified name (memory addresses in repr would change the key between processes), partials with their
+# arguments, containers element by element, rng objects are rejected as their state is not part of the key
+def key_repr(value):
+    if isinstance(value, (np.random.Generator, np.random.RandomState, np.random.BitGenerator)):
+        raise ValueError("%s has no stable key, pass a seed instead" % type(value).__name__)
+    if isinstance(value, functools.partial):
+        return 'partial(%s, %s, %s)' % (key_repr(value.func), key_repr(value.args), key_repr(value.keywords))
+    if isinstance(value, (list, tuple)):
+        return '%s(%s)' % (type(value).__name__, ', '.join(key_repr(v) for v in value))
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join('%r: %s' % (k, key_repr(value[k])) for k in sorted(value))
+    if callable(value) and hasattr(value, '__qualname__'):
+        if '<' in value.__qualname__:
+            raise ValueError("%s has no stable key, use a function or class defined at module level" % value.__qualname__)
+        return value.__module__ + '.' + value.__qualname__
+    return repr(value)
+
+# content hash of the generator (class, parameters and array state), method and arguments
+def cache_key(generator, method, args, kwargs):
+
+    h = hashlib.sha256()
+    h.update(type(generator).__qualname__.encode())
+    h.update(method.encode())
+    for key, value in sorted(vars(generator).items()):
+        h.update(key.encode())
+        if isinstance(value, np.ndarray):
+            h.update(str(value.dtype).encode())
+            h.update(str(value.shape).encode())
+            h.update(np.ascontiguousarray(value).tobytes())
+        else:
+            h.update(key_repr(value).encode())
+    h.update(json.dumps([key_repr(arg) for arg in args]).encode())
+    h.update(json.dumps({key: key_repr(value) for key, value in kwargs.items()}, sort_keys=True).encode())
+    return h.hexdigest()
+
+def _size(path):
+    return sum(f.stat().st_size for f in path.iterdir() if f.is_file())
+
+class DatasetCache:
+
+    def __init__(self, root, max_bytes=16 * 2**30):
+        self.root = pathlib.Path(root).expanduser()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    # reproducible calls only: a seed and no stateful rng, arguments: bound by name, see _arguments
+    def cacheable(self, generator, arguments):
+        return (arguments.get('seed') is not None
+                and arguments.get('rng') is None
+                and getattr(generator, 'rng', None) is None)
+
+    # arguments of the call by name with the defaults, i.e. positional and keyword calls share their entry
+    @staticmethod
+    def _arguments(fn, args, kwargs):
+        bound = inspect.signature(fn).bind(*args, **kwargs)
+        bound.apply_defaults()
+        return dict(bound.arguments)
+
+    # result of getattr(generator, method)(*args, **kwargs), memory-mapped from the cache if available
+    # the generator state after the call (e.g. the Bachelier market drawn on the first call) is restored on hits
+    def __call__(self, generator, method, *args, **kwargs):
+
+        fn = getattr(generator, method)
+        arguments = self._arguments(fn, args, kwargs)
+        if not self.cacheable(generator, arguments):
+            return fn(*args, **kwargs)
+
+        key = cache_key(generator, method, (), arguments)
+        path = self.root / key
+        if path.is_dir() and not (path / STATE_FILE).is_file():
+            # entry of an earlier format
+            shutil.rmtree(path, ignore_errors=True)
+        if path.is_dir():
+            generator.__dict__.update(_load_state(path))
+            # mark as recently used
+            os.utime(path)
+            return datasets.load_dataset(path)
+
+        result = fn(*args, **kwargs)
+        # chunk iterators (trainingSetChunks) are consumed lazily, nothing to store,
+        # likewise results other than tuples of arrays
+        if inspect.isgenerator(result) or not (isinstance(result, tuple) and all(isinstance(a, np.ndarray) for a in result)):
+            return result
+        self._store(path, generator, method, result, arguments)
+        self.evict()
+        return result
+
+    def _store(self, path, generator, method, result, arguments):
+
+        keys = _result_keys(method, arguments, len(result))
+        meta = datasets.generator_meta(generator, method, **arguments)
+
+        # written to a temporary directory and renamed, concurrent readers never see partial entries
+        tmp = pathlib.Path(tempfile.mkdtemp(dir=self.root, prefix='.tmp-'))
+        try:
+            datasets.save_dataset(tmp, result, keys, meta)
+            _save_state(tmp, generator)
+            os.rename(tmp, path)
+        except TypeError:
+            # generator state which cannot be stored without pickle, the result is not cached
+            shutil.rmtree(tmp, ignore_errors=True)
+        except OSError:
+            # entry written concurrently by another process
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not path.is_dir():
+                raise
+
+    def entries(self):
+        return [p for p in self.root.iterdir() if p.is_dir() and not p.name.startswith('.')]
+
+    def size(self):
+        return sum(_size(p) for p in self.entries())
+
+    # removes least recently used entries until the cache fits into max_bytes
+    def evict(self):
+        entries = sorted(self.entries(), key=lambda p: p.stat().st_mtime)
+        sizes = {p: _size(p) for p in entries}
+        total = sum(sizes.values())
+        for p in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(p, ignore_errors=True)
+            total -= sizes[p]
+
+    def clear(self):
+        for p in self.entries():
+            shutil.rmtree(p, ignore_errors=True)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Dataset store
+
+Training and test sets are stored as one raw `.npy` file per array in a directory, together with a `meta.json` for the generator parameters and seed. Loading memory-maps the arrays, i.e. a training job starts without reading the data and pages in only the rows it uses.
+
+    data/sz/train/
+        meta.json
+        x_train.npy
+        y_train.npy
+        dydx_train.npy
+"""
+
+import json
+import pathlib
+
+import numpy as np
+
+# array names of the (X, Y, Z) training sets and (spots, baskets, prices, deltas, vegas) test sets,
+# training names as in the .npz archives
+TRAIN_KEYS = ('x_train', 'y_train', 'dydx_train')
+TEST_KEYS = ('spots', 'baskets', 'prices', 'deltas', 'vegas')
+
+META_FILE = 'meta.json'
+
+# JSON-compatible parameters of a generator (BlackScholes, Bachelier) and a method call on it,
+# e.g. generator_meta(gen, 'trainingSet', m=m, seed=seed)
+def generator_meta(generator, method=None, **kwargs):
+
+    # scalars, dtypes and vectors (e.g. the basket weights), matrices and rngs are skipped
+    def plain(value):
+        if isinstance(value, (bool, int, float, str)) or value is None:
+            return value
+        if isinstance(value, np.dtype):
+            return value.name
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, np.ndarray) and value.ndim == 1:
+            return value.tolist()
+        return None
+
+    params = {key: plain(value) for key, value in vars(generator).items()
+              if plain(value) is not None or value is None}
+    return {
+        'generator': type(generator).__name__,
+        'params': params,
+        'method': method,
+        'args': {key: plain(value) for key, value in kwargs.items()}
+    }
+
+def _write_meta(path, keys, arrays, meta):
+    info = {
+        'keys': list(keys),
+        'shapes': {key: list(array.shape) for key, array in zip(keys, arrays)},
+        'dtypes': {key: np.dtype(array.dtype).str for key, array in zip(keys, arrays)},
+        'meta': meta or {}
+    }
+    with open(path / META_FILE, 'w') as f:
+        json.dump(info, f, indent=2)
+
+# writes arrays, e.g. the (X, Y, Z) tuple of trainingSet, as keys[i].npy to the directory path
+def save_dataset(path, arrays, keys=TRAIN_KEYS, meta=None):
+
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    if len(arrays) != len(keys):
+        raise ValueError("got %d arrays for %d keys" % (len(arrays), len(keys)))
+    for key, array in zip(keys, arrays):
+        np.save(path / (key + '.npy'), np.ascontiguousarray(array), allow_pickle=False)
+    _write_meta(path, keys, arrays, meta)
+
+# writes chunks (tuples of arrays with the same number of rows), e.g. Bachelier.trainingSetChunks,
+# for m rows in total, memory is bounded by the chunk size
+def save_chunks(path, chunks, m, keys=TRAIN_KEYS, meta=None):
+
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    outputs = None
+    start = 0
+    for chunk in chunks:
+        if outputs is None:
+            # shapes and dtypes from the first chunk
+            outputs = [np.lib.format.open_memmap(path / (key + '.npy'), mode='w+',
+                                                 dtype=array.dtype, shape=(m,) + array.shape[1:])
+                       for key, array in zip(keys, chunk)]
+        k = len(chunk[0])
+        if start + k > m:
+            raise ValueError("chunks exceed %d rows" % m)
+        for output, array in zip(outputs, chunk):
+            output[start:start + k] = array
+        start += k
+    if outputs is None or start != m:
+        raise ValueError("chunks provided %d of %d rows" % (start, m))
+    for output in outputs:
+        output.flush()
+    _write_meta(path, keys, outputs, meta)
+
+# meta data as written by save_dataset / save_chunks
+def load_meta(path):
+    with open(pathlib.Path(path) / META_FILE) as f:
+        return json.load(f)
+
+# arrays of a stored dataset in the stored order, memory-mapped read-only by default
+# mmap_mode=None reads the arrays into memory
+def load_dataset(path, mmap_mode='r'):
+    path = pathlib.Path(path)
+    keys = load_meta(path)['keys']
+    return tuple(np.load(path / (key + '.npy'), mmap_mode=mmap_mode, allow_pickle=False) for key in keys)
+
+# iterates over row chunks of (memory-mapped) arrays, only the current chunk is paged in,
+# e.g. for models.dataset_from_chunks
+def iter_chunks(arrays, chunk_size=65536):
+    m = len(arrays[0])
+    for start in range(0, m, chunk_size):
+        yield tuple(np.asarray(array[start:start + chunk_size]) for array in arrays)
+
+# converts a .npz archive (e.g. data/sz/train.npz) to a dataset directory
+def convert_npz(npz_path, path, meta=None):
+    with np.load(npz_path) as archive:
+        keys = archive.files
+        save_dataset(path, [archive[key] for key in keys], keys, meta)
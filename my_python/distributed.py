@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""Distributed training
+
+Data-parallel training on several workers (processes on one or more nodes) with `tf.distribute.MultiWorkerMirroredStrategy`. Every worker simulates or loads its own shard of the training set. The statistics of the prep layer and the weights of the `L2ScaledMSE` loss are computed globally: the moments of the shards (`MomentAccumulator`) are gathered over the workers and merged, so all workers fit the same prep layer as a single process on the full training set. Gradients are all-reduced in every step, one step consumes `batch_size` samples in total over the workers.
+
+    # on every worker, with TF_CONFIG describing the cluster
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    task, workers = task_info(strategy)
+    x, y, dydx = generator.trainingSet(m // workers, rng=shard_rng(seed, task, workers))
+    prep_layer, scaled_MSE = preprocess_global(strategy, x, y, dydx, 'PCA')
+    model = models.build_and_compile_model(prep_layer.output_n(), models.get_model_twin_net, scaled_MSE, strategy=strategy)
+    history = train_distributed(model, prep_layer, strategy, x, y, dydx, epochs=100)
+
+`run_local` starts such a cluster as processes on one host and `python -m my_python.distributed` measures the scaling efficiency from 1 to N workers.
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import socket
+import sys
+import time
+
+import numpy as np
+
+# TF_CONFIG of every worker of a cluster on one host
+def local_cluster(num_workers, host='localhost'):
+    sockets = [socket.socket() for _ in range(num_workers)]
+    for s in sockets:
+        s.bind((host, 0))
+    workers = ['%s:%d' % (host, s.getsockname()[1]) for s in sockets]
+    for s in sockets:
+        s.close()
+    return [{'cluster': {'worker': workers}, 'task': {'type': 'worker', 'index': i}} for i in range(num_workers)]
+
+# index of this worker and number of workers
+def task_info(strategy):
+    resolver = strategy.cluster_resolver
+    if resolver is None or not resolver.cluster_spec().as_dict():
+        return 0, 1
+    return resolver.task_id or 0, resolver.cluster_spec().num_tasks('worker')
+
+# independent random numbers for the shard of a worker, see np.random.SeedSequence.spawn
+def shard_rng(seed, task_index, num_workers, bitGenerator='PCG64'):
+    seed_seq = np.random.SeedSequence(seed).spawn(num_workers)[task_index]
+    return np.random.Generator(getattr(np.random, bitGenerator)(seed_seq))
+
+# rows of a worker in a data set of m rows, equal shards (the remainder is dropped)
+def shard_slice(m, task_index, num_workers):
+    size = m // num_workers
+    return slice(task_index * size, (task_index + 1) * size)
+
+# moments of the full training set from the moments of the shards (MomentAccumulator) of all workers,
+# the same merge order on every worker gives identical statistics
+def global_statistics(strategy, stats):
+
+    import tensorflow as tf
+    from my_python.models import MomentAccumulator
+
+    n = np.size(stats.mean_x)
+    vector = stats.to_vector()
+    _, num_workers = task_info(strategy)
+    local_replicas = max(1, strategy.num_replicas_in_sync // num_workers)
+
+    # one contribution per worker, empty statistics from further local replicas
+    def value(ctx):
+        contribution = vector if ctx.replica_id_in_sync_group % local_replicas == 0 else np.zeros_like(vector)
+        return tf.constant(contribution[np.newaxis])
+
+    gathered = strategy.gather(strategy.experimental_distribute_values_from_function(value), axis=0).numpy()
+    merged = MomentAccumulator(stats.full)
+    for row in gathered:
+        merged.merge(MomentAccumulator.from_vector(row, n, stats.full))
+    return merged
+
+# prep layer and loss from the global statistics, x, y and dydx: the shard of this worker
+def preprocess_global(strategy, x_shard, y_shard, dydx_shard, prep_type='Normalisation', dtype=None):
+
+    from my_python import models
+
+    stats = models.MomentAccumulator(full=(prep_type == 'PCA')).update(x_shard, y_shard, dydx_shard)
+    return models.preprocess_statistics(global_statistics(strategy, stats), prep_type, dtype)
+
+# trains on the shards of the workers, batch_size: global batch size over all workers
+def train_distributed(model, prep_layer, strategy, x_shard, y_shard, dydx_shard, epochs=None, batch_size=None,
+                      x_true=None, y_true=None, dydx_true=None, shuffle_buffer=None, seed=None, progress=None):
+
+    import tensorflow as tf
+    from my_python import models
+
+    epochs = models.EPOCHS if epochs is None else epochs
+    batch_size = models.BATCH_SIZE if batch_size is None else batch_size
+    task, num_workers = task_info(strategy)
+    if batch_size % strategy.num_replicas_in_sync:
+        raise ValueError("batch size %d is not divisible by %d replicas" % (batch_size, strategy.num_replicas_in_sync))
+
+    # per-replica batches of the own shard, repeated, all workers run the same number of steps per epoch
+    per_replica = batch_size // strategy.num_replicas_in_sync
+    steps_per_epoch = len(x_shard) * num_workers // batch_size
+
+    def dataset(ctx):
+        return models.prepare_dataset(models.dataset_from_arrays(x_shard, y_shard, dydx_shard), prep_layer,
+                                      per_replica, shuffle_buffer, seed=seed).repeat()
+
+    return models.train_model(model, prep_layer, None, strategy.distribute_datasets_from_function(dataset), None,
+                              epochs=epochs, batch_size=batch_size, x_true=x_true, y_true=y_true, dydx_true=dydx_true,
+                              progress=(task == 0) if progress is None else progress, steps_per_epoch=steps_per_epoch)
+
+def _launch(fn, tf_config, threads, results, args):
+    os.environ['TF_CONFIG'] = json.dumps(tf_config)
+    for var in ('OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS'):
+        os.environ[var] = str(threads)
+    try:
+        result = fn(*args)
+    except Exception as e:
+        # reported to run_local, which would otherwise wait for the result forever
+        result = RuntimeError("worker %d failed: %r" % (tf_config['task']['index'], e))
+    results.put((tf_config['task']['index'], result))
+
+# runs fn(*args) on num_workers local processes forming one cluster, returns the results by worker,
+# threads: TensorFlow threads per worker, defaults to the cores shared by the workers
+def run_local(fn, num_workers, *args, threads=None):
+    threads = threads or max(1, (os.cpu_count() or 1) // num_workers)
+    context = mp.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=_launch, args=(fn, tf_config, threads, results, args))
+                 for tf_config in local_cluster(num_workers)]
+    for process in processes:
+        process.start()
+    collected = dict(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    for result in collected.values():
+        if isinstance(result, RuntimeError):
+            raise result
+    return [collected[i] for i in range(num_workers)]
+
+# worker of the scaling benchmark: Bachelier basket of n assets, m samples in total
+def bachelier_worker(n, m, epochs, batch_size, prep_type='PCA', model_getter='get_model_twin_net', seed=1234):
+
+    import tensorflow as tf
+    from my_python import models
+    from my_python.generators import Bachelier
+
+    strategy = tf.distribute.MultiWorkerMirroredStrategy()
+    task, num_workers = task_info(strategy)
+
+    # same market on all workers, independent shards
+    generator = Bachelier(n, dtype=np.float32).calibrate(seed=seed)
+    start = time.perf_counter()
+    x, y, dydx = generator.trainingSet(m // num_workers, rng=shard_rng(seed, task, num_workers))
+    x_true, _, y_true, dydx_true, _ = generator.testSet(num=4096, seed=seed + 1)
+    prep_layer, scaled_MSE = preprocess_global(strategy, x, y, dydx, prep_type)
+    data_time = time.perf_counter() - start
+
+    tf.keras.utils.set_random_seed(seed)
+    model = models.build_and_compile_model(
+        prep_layer.output_n(), getattr(models, model_getter), scaled_MSE,
+        lr_schedule=models.WarmUpSchedule(m // batch_size, epochs=epochs), strategy=strategy)
+
+    start = time.perf_counter()
+    history = train_distributed(model, prep_layer, strategy, x, y, dydx, epochs, batch_size,
+                                x_true, y_true.reshape(-1, 1), dydx_true, progress=False)
+    train_time = time.perf_counter() - start
+
+    y_pred, dydx_pred = models.predict_unscaled(model, prep_layer, x_true, verbose=0)
+    return {
+        'workers': num_workers,
+        'task': task,
+        'data_time': data_time,
+        'train_time': train_time,
+        'samples_per_second': m * epochs / train_time,
+        'val_loss': float(history.history['val_loss'][-1]),
+        'rmse_price': float(np.sqrt(np.mean((y_pred - y_true.reshape(-1, 1)) ** 2))),
+        'rmse_delta': float(np.sqrt(np.mean((dydx_pred - dydx_true) ** 2))),
+        'muX': np.asarray(prep_layer.muX).tolist()
+    }
+
+# throughput with 1 to N local workers and efficiency relative to linear scaling of one worker
+def scaling(workers=(1, 2, 4), n=10, m=2**16, epochs=5, batch_size=1024, prep_type='PCA',
+            model_getter='get_model_twin_net', seed=1234, threads=None, log=print):
+    rows = []
+    for num_workers in workers:
+        chief = run_local(bachelier_worker, num_workers, n, m, epochs, batch_size, prep_type, model_getter, seed,
+                          threads=threads)[0]
+        row = {key: value for key, value in chief.items() if key not in ('task', 'muX')}
+        row['efficiency'] = row['samples_per_second'] / (num_workers * rows[0]['samples_per_second'] / rows[0]['workers']) if rows else 1.0
+        log('workers %2d  %10.0f samples/s  efficiency %5.2f  rmse price %.5f delta %.5f' % (
+            num_workers, row['samples_per_second'], row['efficiency'], row['rmse_price'], row['rmse_delta']))
+        rows.append(row)
+    return rows
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Scaling efficiency of data-parallel training on local workers')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--n', type=int, default=10)
+    parser.add_argument('--m', type=int, default=2**16)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--prep-type', default='PCA')
+    parser.add_argument('--model', default='get_model_twin_net')
+    parser.add_argument('--threads', type=int, default=None, help='TensorFlow threads per worker')
+    parser.add_argument('--out', help='JSON file for the results')
+    args = parser.parse_args(argv)
+
+    rows = scaling(args.workers, args.n, args.m, args.epochs, args.batch_size, args.prep_type, args.model,
+                   threads=args.threads)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({'cpu_count': os.cpu_count(), 'results': rows}, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Export to NumPy
+
+Exports a trained model (twin net, autodiff or autodiff with autoencoder) together with its prep layer to a compact `.npz` file, which `NumpyPricer` evaluates with plain NumPy, i.e. without importing TensorFlow.
+
+The pre-processing (and a linear autoencoder) is folded into the first layer and the post-processing of values into the last layer. The network then maps raw inputs to unscaled prices, and its analytic derivative by backpropagation is the unscaled delta. The activation of the hidden layers (softplus, sigmoid, tanh or swish) is read from the model and stored in the file.
+
+    export_model(model, prep_layer, 'pricer.npz')      # training process
+
+    pricer = NumpyPricer.load('pricer.npz')            # worker, numpy only
+    y, dydx = pricer.predict(x)
+"""
+
+import numpy as np
+
+# activations and their derivatives, the activations of ACTIVATION_DERIVATIVES in my_python.models
+def softplus(z):
+    return np.logaddexp(0.0, z)
+
+def sigmoid(z):
+    return 0.5 * (1.0 + np.tanh(0.5 * z))
+
+def _sigmoid_derivative(z):
+    s = sigmoid(z)
+    return s * (1.0 - s)
+
+def _tanh_derivative(z):
+    return 1.0 - np.tanh(z) ** 2
+
+def swish(z):
+    return z * sigmoid(z)
+
+def _swish_derivative(z):
+    s = sigmoid(z)
+    return s * (1.0 + z * (1.0 - s))
+
+ACTIVATIONS = {
+    'softplus': (softplus, sigmoid),
+    'sigmoid': (sigmoid, _sigmoid_derivative),
+    'tanh': (np.tanh, _tanh_derivative),
+    'swish': (swish, _swish_derivative)
+}
+
+def _check_activation(activation):
+    if activation not in ACTIVATIONS:
+        raise ValueError("activation %r is not supported by the export, supported: %s" % (activation, ', '.join(ACTIVATIONS)))
+
+# folded weights and biases of the raw-to-unscaled network: the prep layer and the linear layers of
+# an autoencoder are folded into the first activated layer, the post-processing of values into y_pred
+def fold_model(model, prep_layer):
+
+    from my_python._models import _layer_stack
+
+    W, b = [np.asarray(a, dtype=np.float64) for a in prep_layer.x_affine()]
+    stack = _layer_stack(model)
+    weights, biases = [], []
+    for i, (layer, activated) in enumerate(stack):
+        kernel, bias = [np.asarray(a, dtype=np.float64) for a in layer.get_weights()]
+        W, b = W @ kernel, b @ kernel + bias
+        if activated or i == len(stack) - 1:
+            weights.append(W)
+            biases.append(b)
+            W, b = np.eye(W.shape[1]), np.zeros(W.shape[1])
+
+    scale, shift = [np.asarray(a, dtype=np.float64).reshape(-1) for a in prep_layer.y_affine()]
+    weights[-1], biases[-1] = weights[-1] * scale, biases[-1] * scale + shift
+
+    return weights, biases
+
+# activation: of the hidden layers, by default read from the model
+def export_model(model, prep_layer, path, activation=None, dtype=np.float32):
+    if activation is None:
+        from my_python._models import _activation_name
+        activation = _activation_name(model)
+    _check_activation(activation)
+    weights, biases = fold_model(model, prep_layer)
+    arrays = {}
+    for i, (kernel, bias) in enumerate(zip(weights, biases)):
+        arrays['W%d' % i] = kernel.astype(dtype)
+        arrays['b%d' % i] = bias.astype(dtype)
+    np.savez(path, activation=np.array(activation), layers=np.array(len(weights)), **arrays)
+
+class NumpyPricer:
+
+    def __init__(self, weights, biases, activation='softplus'):
+        _check_activation(activation)
+        self.weights = weights
+        self.biases = biases
+        self.activation, self.derivative = ACTIVATIONS[activation]
+        # transposed kernels for the backpropagation, computed once
+        self.weights_T = [np.ascontiguousarray(kernel.T) for kernel in weights]
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            layers = int(f['layers'])
+            weights = [f['W%d' % i] for i in range(layers)]
+            biases = [f['b%d' % i] for i in range(layers)]
+            return cls(weights, biases, str(f['activation']))
+
+    # price (kx1) and delta (kxn) for raw inputs x (kxn)
+    def predict(self, x):
+
+        x = np.asarray(x, dtype=self.weights[0].dtype)
+
+        # feedforward, keep pre-activations for the backpropagation
+        zs = []
+        a = x
+        for kernel, bias in zip(self.weights[:-1], self.biases[:-1]):
+            z = a @ kernel + bias
+            zs.append(z)
+            a = self.activation(z)
+        y = a @ self.weights[-1] + self.biases[-1]
+
+        # backprop (twin net)
+        gradient = np.broadcast_to(self.weights_T[-1], (len(x), self.weights_T[-1].shape[1]))
+        for z, kernel_T in zip(reversed(zs), reversed(self.weights_T[:-1])):
+            gradient = (gradient * self.derivative(z)) @ kernel_T
+
+        return y, gradient
@@ -7,22 +7,139 @@ Original file is located at
     https://colab.research.google.com/drive/1fnRzpzt5mzgvpTdbjunxUmvqt5ackNzp
 """
 
+import os
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
-from scipy.stats import norm  
+from scipy.stats.qmc import Sobol
+from scipy.special import ndtr, ndtri
+
+# standard normal density, ndtr and normPdf avoid the overhead of scipy.stats.norm
+_sqrt2pi = np.sqrt(2 * np.pi)
+def normPdf(x):
+    return np.exp(-x**2 / 2.0) / _sqrt2pi
+
 # helper analytics    
 def bsPrice(spot, strike, vol, T):
-    d1 = (np.log(spot/strike) + vol * vol * T) / vol / np.sqrt(T)
-    d2 = d1 - vol * np.sqrt(T)
-    return spot * norm.cdf(d1) - strike * norm.cdf(d2)
+    return bsGreeks(spot, strike, vol, T)[0]
 
 def bsDelta(spot, strike, vol, T):
     d1 = (np.log(spot/strike) + vol * vol * T) / vol / np.sqrt(T)
-    return norm.cdf(d1)
+    return ndtr(d1)
 
 def bsVega(spot, strike, vol, T):
     d1 = (np.log(spot/strike) + vol * vol * T) / vol / np.sqrt(T)
-    return spot * np.sqrt(T) * norm.pdf(d1)
+    return spot * np.sqrt(T) * normPdf(d1)
+
+# price, delta, vega and gamma in one pass over d1, d2, cdf and pdf
+def bsGreeks(spot, strike, vol, T):
+    sqrtT = np.sqrt(T)
+    volSqrtT = vol * sqrtT
+    d1 = (np.log(spot/strike) + vol * vol * T) / vol / sqrtT
+    d2 = d1 - volSqrtT
+    cdf1 = ndtr(d1)
+    pdf1 = normPdf(d1)
+    price = spot * cdf1 - strike * ndtr(d2)
+    delta = cdf1
+    vega = spot * sqrtT * pdf1
+    gamma = pdf1 / (spot * volSqrtT)
+    return price, delta, vega, gamma
 #
+
+# random number generation
+
+# random generator with a choice of bit generator, e.g. 'PCG64', 'PCG64DXSM', 'Philox' or 'SFC64'
+def makeRng(seed=None, bitGenerator='PCG64'):
+    return np.random.Generator(getattr(np.random, bitGenerator)(seed))
+
+# generator for one draw: the rng passed to the call, the rng of the instance (seeds ignored),
+# a new generator with the bit generator of the instance, or by default a local legacy 
+# RandomState which reproduces the former np.random.seed(seed) streams without the global state
+def _resolveRng(seed=None, rng=None, instanceRng=None, bitGenerator=None):
+    if rng is not None:
+        return rng
+    if instanceRng is not None:
+        return instanceRng
+    if bitGenerator is not None:
+        return makeRng(seed, bitGenerator)
+    return np.random.RandomState(seed)
+
+# standard normals in dtype, np.random.Generator samples single precision natively
+def _normals(rng, size, dtype=np.float64):
+    if isinstance(rng, np.random.Generator):
+        return rng.standard_normal(size=size, dtype=dtype)
+    return rng.normal(size=size).astype(dtype, copy=False)
+
+# products of the rows of x (kxn) with the matrix m, x @ m.T (kxn), or the vector m, x @ m (k)
+# rowwise: by einsum, which reduces every row on its own and in the same order for any number of rows k,
+# matmul (BLAS) blocks the rows, so the rounding of a row depends on k, but is faster for large n
+def _rowProducts(x, m, rowwise=False):
+    if not rowwise:
+        return x @ m.T
+    return np.einsum('kj,ij->ki' if m.ndim == 2 else 'kj,j->k', x, m)
+
+# quasi random numbers
+
+# scrambled Sobol sequence in d dimensions, the scrambling is drawn from rng
+# successive calls of random(k) continue the sequence, 
+# balance properties require powers of two for the number of points
+def sobolEngine(d, rng):
+    return Sobol(d, scramble=True, seed=rng)
+
+# Sobol points (kxd) mapped to standard normals by the inverse normal cdf
+def sobolNormals(engine, k, dtype=np.float64):
+    return ndtri(engine.random(k)).astype(dtype, copy=False)
+
+# parallel simulation
+
+# shared output buffers of the worker processes, set by the pool initializer
+_sharedOutputs = None
+
+def _sharedArrays(buffers, shapes, dtype):
+    return [np.frombuffer(buffer, dtype=dtype).reshape(shape) for buffer, shape in zip(buffers, shapes)]
+
+def _initSharedOutputs(buffers, shapes, dtype):
+    global _sharedOutputs
+    _sharedOutputs = _sharedArrays(buffers, shapes, dtype)
+
+# simulates paths [start, stop) in chunks into the (shared) outputs,
+# with an independent stream for the block
+def _simulateBlock(block, start, stop, seedSeq, bitGenerator, chunkSize, kwargs, outputs=None):
+    outputs = _sharedOutputs if outputs is None else outputs
+    rng = makeRng(seedSeq, bitGenerator)
+    for i in range(start, stop, chunkSize):
+        k = min(chunkSize, stop - i)
+        for out, res in zip(outputs, block(rng, k, **kwargs)):
+            out[i:i+k] = res
+
+# splits m paths in contiguous blocks over a pool of worker processes,
+# block(rng, k, **kwargs) returns X (kxnX), Y (kx1) and Z (kxnZ) for k paths
+# each worker draws from a stream spawned from np.random.SeedSequence(seed)
+# and writes into shared memory, so the result is bitwise reproducible 
+# for a given seed, number of workers and bit generator
+def simulateParallel(block, m, nX, nZ, workers=None, seed=None, bitGenerator='PCG64', chunkSize=65536, 
+                     dtype=np.float64, **kwargs):
+
+    workers = workers or os.cpu_count()
+    seedSeqs = np.random.SeedSequence(seed).spawn(workers)
+    bounds = np.linspace(0, m, workers + 1).astype(int)
+
+    shapes = [(m, nX), (m, 1), (m, nZ)]
+    dtype = np.dtype(dtype)
+    buffers = [mp.RawArray(np.ctypeslib.as_ctypes_type(dtype), int(np.prod(shape))) for shape in shapes]
+    outputs = _sharedArrays(buffers, shapes, dtype)
+
+    if workers == 1:
+        _simulateBlock(block, 0, m, seedSeqs[0], bitGenerator, chunkSize, kwargs, outputs)
+    else:
+        with ProcessPoolExecutor(workers, initializer=_initSharedOutputs, initargs=(buffers, shapes, dtype)) as pool:
+            futures = [pool.submit(_simulateBlock, block, bounds[w], bounds[w+1], seedSeqs[w], bitGenerator, chunkSize, kwargs) 
+                       for w in range(workers)]
+            for future in futures:
+                future.result()
+
+    return tuple(outputs)
     
 # main class
 class BlackScholes:
@@ -34,7 +151,10 @@ class BlackScholes:
                  K=1.10,
                  volMult=1.5,
                  lower=0.35,
-                 upper=1.65):
+                 upper=1.65,
+                 bitGenerator=None,
+                 rng=None,
+                 dtype=np.float64):
         
         self.spot = 1
         self.vol = vol
@@ -42,128 +162,210 @@ class BlackScholes:
         self.T2 = T2
         self.K = K
         self.volMult = volMult
-                        
-    # training set: returns S1 (mx1), C2 (mx1) and dC2/dS1 (mx1)
-    def trainingSet(self, m,  anti=True, seed=None):
-    
-        np.random.seed(seed)
-        
-        # 2 sets of normal returns
-        returns = np.random.normal(size=[m, 2])
 
-        # SDE
-        vol0 = self.vol * self.volMult
-        R1 = np.exp(-0.5*vol0*vol0*self.T1 + vol0*np.sqrt(self.T1)*returns[:,0])
+        # random numbers, see _resolveRng: 
+        # np.random.Generator for all draws or bit generator for seeded draws
+        self.bitGenerator = bitGenerator
+        self.rng = rng
 
-        R2 = np.exp(-0.5*self.vol*self.vol*(self.T2-self.T1) \
-                    + self.vol*np.sqrt(self.T2-self.T1)*returns[:,1])
-        S1 = self.spot * R1
-        S2 = S1 * R2 
+        # float type of all generated sets, e.g. np.float32 to feed training without conversion
+        self.dtype = np.dtype(dtype)
+                        
+    # payoff and differentials for spots S1 (k) at T1 and normal returns (k) over [T1,T2]
+    # returns S1 (kx1), C2 (kx1) and dC2/dS1 (kx1)
+    def _paths(self, S1, normals, anti=True):
+
+        # SDE, coefficients as Python floats keep the precision of the normals
+        drift = -0.5*self.vol*self.vol*(self.T2-self.T1)
+        diffusion = float(self.vol*np.sqrt(self.T2-self.T1))
+        # returns are computed in place, R2 = exp(drift + diffusion * normals)
+        R2 = np.multiply(normals, diffusion)
 
-        # payoff
-        pay = np.maximum(0, S2 - self.K)
-        
         # two antithetic paths
         if anti:
-            
-            R2a = np.exp(-0.5*self.vol*self.vol*(self.T2-self.T1) \
-                    - self.vol*np.sqrt(self.T2-self.T1)*returns[:,1])
+
+            # single pass with in-place buffers: R2, R2a become the differentials Z1, Z2
+            # and S2, S2a the payoffs, then the averages Z and Y
+            R2a = np.negative(R2)
+            R2 += drift
+            np.exp(R2, out=R2)
+            R2a += drift
+            np.exp(R2a, out=R2a)
+
+            S2 = S1 * R2 
             S2a = S1 * R2a             
-            paya = np.maximum(0, S2a - self.K)
+
+            # differentials
+            np.multiply(R2, S2 > self.K, out=R2)
+            np.multiply(R2a, S2a > self.K, out=R2a)
+            Z = R2
+            Z += R2a
+            Z *= 0.5
+
+            # payoff
+            S2 -= self.K
+            pay = np.maximum(S2, 0, out=S2)
+            S2a -= self.K
+            paya = np.maximum(S2a, 0, out=S2a)
             
             X = S1
-            Y = 0.5 * (pay + paya)
-    
-            # differentials
-            Z1 =  np.where(S2 > self.K, R2, 0.0).reshape((-1,1)) 
-            Z2 =  np.where(S2a > self.K, R2a, 0.0).reshape((-1,1)) 
-            Z = 0.5 * (Z1 + Z2)
+            Y = pay
+            Y += paya
+            Y *= 0.5
                     
         # standard
         else:
+
+            R2 += drift
+            np.exp(R2, out=R2)
+            S2 = S1 * R2 
         
             X = S1
-            Y = pay
             
             # differentials
-            Z =  np.where(S2 > self.K, R2, 0.0).reshape((-1,1)) 
+            Z = np.multiply(R2, S2 > self.K, out=R2)
+
+            # payoff
+            S2 -= self.K
+            Y = np.maximum(S2, 0, out=S2)
         
         return X.reshape([-1,1]), Y.reshape([-1,1]), Z.reshape([-1,1])
-    
-    def trainingSetUniformS1(self, m, lower=0.35, upper=1.65, anti=True, seed=None):
 
-        np.random.seed(seed)
+    # second-order labels d2C2/dS1^2 (kx1) for spots S1 (k) and normal returns (k) over [T1,T2], 
+    # likelihood ratio on the pathwise delta, 1{S2>K} S2/S1^2 (normals/(vol sqrt(T2-T1)) - 1), 
+    # an unbiased estimate of the gamma (the pathwise gamma of the payoff is zero)
+    def _gammas(self, S1, normals, anti=True):
 
-        # 1 set of uniform samples in the one-dim parameter space for S1=S1(R1)
-        S1 = np.random.uniform(lower,upper,m)
-        
-        # 2 sets of normal returns, only R2 required
-        returns = np.random.normal(size=[m, 1])
+        diffusion = float(self.vol*np.sqrt(self.T2-self.T1))
+        drift = -0.5*self.vol*self.vol*(self.T2-self.T1)
+        score = normals / diffusion
+
+        def gamma(sign):
+            S2 = S1 * np.exp(drift + sign * diffusion * normals)
+            return (S2 > self.K) * S2 / (S1 * S1) * (sign * score - 1.0)
+
+        G = 0.5 * (gamma(1.0) + gamma(-1.0)) if anti else gamma(1.0)
+        return G.astype(self.dtype, copy=False).reshape([-1,1])
 
-        # SDE
-        R2 = np.exp(-0.5*self.vol*self.vol*(self.T2-self.T1) \
-                    + self.vol*np.sqrt(self.T2-self.T1)*returns[:,0])
-        # S1 = self.spot * R1
-        S2 = S1 * R2 
+    # S1 (k) at T1 from normal returns (k)
+    def _spots(self, normals):
 
-        # payoff
-        pay = np.maximum(0, S2 - self.K)
+        vol0 = self.vol * self.volMult
+        R1 = np.exp(-0.5*vol0*vol0*self.T1 + float(vol0*np.sqrt(self.T1))*normals)
+        return self.spot * R1
+
+    def _rng(self, seed=None, rng=None):
+        return _resolveRng(seed, rng, self.rng, self.bitGenerator)
+
+    # training set: returns S1 (mx1), C2 (mx1) and dC2/dS1 (mx1)
+    # qmc: returns from a scrambled Sobol sequence instead of pseudo random numbers
+    # gamma: also returns second-order labels d2C2/dS1^2 (mx1), see _gammas
+    def trainingSet(self, m,  anti=True, seed=None, rng=None, qmc=False, gamma=False):
+    
+        rng = self._rng(seed, rng)
         
-        # two antithetic paths
-        if anti:
-            
-            R2a = np.exp(-0.5*self.vol*self.vol*(self.T2-self.T1) \
-                    - self.vol*np.sqrt(self.T2-self.T1)*returns[:,0])
-            S2a = S1 * R2a             
-            paya = np.maximum(0, S2a - self.K)
-            
-            X = S1
-            Y = 0.5 * (pay + paya)
+        # 2 sets of normal returns
+        if qmc:
+            returns = sobolNormals(sobolEngine(2, rng), m, self.dtype)
+        else:
+            returns = _normals(rng, [m, 2], self.dtype)
+
+        S1 = self._spots(returns[:,0])
+        if gamma:
+            return self._paths(S1, returns[:,1], anti) + (self._gammas(S1, returns[:,1], anti),)
+        return self._paths(S1, returns[:,1], anti)
+
+    # block of k paths for the parallel simulation, drawn from the generator rng
+    def _trainingSetBlock(self, rng, k, anti=True):
+
+        returns = _normals(rng, [k, 2], self.dtype)
+        return self._paths(self._spots(returns[:,0]), returns[:,1], anti)
+
+    # training set simulated on a pool of worker processes, see simulateParallel
+    def trainingSetParallel(self, m, anti=True, seed=None, workers=None):
+
+        return simulateParallel(self._trainingSetBlock, m, 1, 1, workers=workers, seed=seed, 
+                                bitGenerator=self.bitGenerator or 'PCG64', dtype=self.dtype, anti=anti)
     
-            # differentials
-            Z1 =  np.where(S2 > self.K, R2, 0.0).reshape((-1,1)) 
-            Z2 =  np.where(S2a > self.K, R2a, 0.0).reshape((-1,1)) 
-            Z = 0.5 * (Z1 + Z2)
-                    
-        # standard
+    # qmc: S1 and returns from a scrambled Sobol sequence instead of pseudo random numbers
+    # gamma: also returns second-order labels d2C2/dS1^2 (mx1), see _gammas
+    def trainingSetUniformS1(self, m, lower=0.35, upper=1.65, anti=True, seed=None, rng=None, qmc=False, 
+                             gamma=False):
+
+        rng = self._rng(seed, rng)
+
+        if qmc:
+            uniforms = sobolEngine(2, rng).random(m)
+            S1 = (lower + (upper - lower) * uniforms[:,0]).astype(self.dtype, copy=False)
+            returns = ndtri(uniforms[:,1:]).astype(self.dtype, copy=False)
         else:
+            # 1 set of uniform samples in the one-dim parameter space for S1=S1(R1)
+            S1 = rng.uniform(lower,upper,m).astype(self.dtype, copy=False)
         
-            X = S1
-            Y = pay
-            
-            # differentials
-            Z =  np.where(S2 > self.K, R2, 0.0).reshape((-1,1)) 
-        
-        return X.reshape([-1,1]), Y.reshape([-1,1]), Z.reshape([-1,1])
+            # 2 sets of normal returns, only R2 required
+            returns = _normals(rng, [m, 1], self.dtype)
+
+        if gamma:
+            return self._paths(S1, returns[:,0], anti) + (self._gammas(S1, returns[:,0], anti),)
+        return self._paths(S1, returns[:,0], anti)
+
+    # block of k paths for the parallel simulation, drawn from the generator rng
+    def _trainingSetUniformS1Block(self, rng, k, lower=0.35, upper=1.65, anti=True):
+
+        S1 = rng.uniform(lower, upper, k).astype(self.dtype, copy=False)
+        returns = _normals(rng, k, self.dtype)
+        return self._paths(S1, returns, anti)
+
+    # uniform S1 training set simulated on a pool of worker processes, see simulateParallel
+    def trainingSetUniformS1Parallel(self, m, lower=0.35, upper=1.65, anti=True, seed=None, workers=None):
+
+        return simulateParallel(self._trainingSetUniformS1Block, m, 1, 1, workers=workers, seed=seed, 
+                                bitGenerator=self.bitGenerator or 'PCG64', dtype=self.dtype, 
+                                lower=lower, upper=upper, anti=anti)
 
     # test set: returns a grid of uniform spots 
     # with corresponding ground true prices, deltas and vegas
-    def testSet(self, lower=0.35, upper=1.65, num=100, seed=None):
+    # gamma: also returns the gammas (numx1)
+    def testSet(self, lower=0.35, upper=1.65, num=100, seed=None, gamma=False):
         
         spots = np.linspace(lower, upper, num).reshape((-1, 1))
         # compute prices, deltas and vegas
-        prices = bsPrice(spots, self.K, self.vol, self.T2 - self.T1).reshape((-1, 1))
-        deltas = bsDelta(spots, self.K, self.vol, self.T2 - self.T1).reshape((-1, 1))
-        vegas = bsVega(spots, self.K, self.vol, self.T2 - self.T1).reshape((-1, 1))
+        prices, deltas, vegas, gammas = bsGreeks(spots, self.K, self.vol, self.T2 - self.T1)
+        spots, prices, deltas, vegas, gammas = [x.astype(self.dtype, copy=False) for x in (spots, prices, deltas, vegas, gammas)]
+        if gamma:
+            return spots, spots, prices, deltas, vegas, gammas
         return spots, spots, prices, deltas, vegas
 
 # helper analytics
 def bachPrice(spot, strike, vol, T):
     d = (spot - strike) / vol / np.sqrt(T)
-    return  vol * np.sqrt(T) * (d * norm.cdf(d) + norm.pdf(d))
+    return  vol * np.sqrt(T) * (d * ndtr(d) + normPdf(d))
 
 def bachDelta(spot, strike, vol, T):
     d = (spot - strike) / vol / np.sqrt(T)
-    return norm.cdf(d)
+    return ndtr(d)
 
 def bachVega(spot, strike, vol, T):
     d = (spot - strike) / vol / np.sqrt(T)
-    return np.sqrt(T) * norm.pdf(d)
+    return np.sqrt(T) * normPdf(d)
+
+# price, delta, vega and gamma in one pass over d, cdf and pdf
+def bachGreeks(spot, strike, vol, T):
+    sqrtT = np.sqrt(T)
+    d = (spot - strike) / vol / sqrtT
+    cdf = ndtr(d)
+    pdf = normPdf(d)
+    price = vol * sqrtT * (d * cdf + pdf)
+    delta = cdf
+    vega = sqrtT * pdf
+    gamma = pdf / (vol * sqrtT)
+    return price, delta, vega, gamma
 #
     
-# generates a random correlation matrix
-def genCorrel(n):
-    randoms = np.random.uniform(low=-1., high=1., size=(2*n, n))
+# generates a random correlation matrix, from the global random state if no rng is given
+def genCorrel(n, rng=None):
+    rng = np.random if rng is None else rng
+    randoms = rng.uniform(low=-1., high=1., size=(2*n, n))
     cov = randoms.T @ randoms
     invvols = np.diag(1. / np.sqrt(np.diagonal(cov)))
     return np.linalg.multi_dot([invvols, cov, invvols])
@@ -175,29 +377,47 @@ class Bachelier:
                  T1=1, 
                  T2=2, 
                  K=1.10,
-                 volMult=1.5):
+                 volMult=1.5,
+                 bitGenerator=None,
+                 rng=None,
+                 dtype=np.float64):
         
         self.n = n
         self.T1 = T1
         self.T2 = T2
         self.K = K
         self.volMult = volMult
+
+        # market (correlation, weights, vols, Choleski factors) is drawn on 
+        # the first sample draw or by calibrate and reused afterwards
+        self.chol = None
+
+        # random numbers, see _resolveRng: 
+        # np.random.Generator for all draws or bit generator for seeded draws
+        self.bitGenerator = bitGenerator
+        self.rng = rng
+
+        # float type of all generated sets, e.g. np.float32 to feed training without conversion,
+        # the market itself is kept in double precision
+        self.dtype = np.dtype(dtype)
+
+    def _rng(self, seed=None, rng=None):
+        return _resolveRng(seed, rng, self.rng, self.bitGenerator)
                 
-    # training set: returns S1 (mxn), C2 (mx1) and dC2/dS1 (mxn)
-    def trainingSet(self, m, anti=True, seed=None, bktVol=0.2):
-    
-        np.random.seed(seed)
+    # draws a random market from rng: correlation, basket weights and vols 
+    # normalised to bktVol with Choleski factors for simulation
+    def _setupMarket(self, rng, bktVol=0.2):
 
         # spots all currently 1, without loss of generality
         self.S0 = np.repeat(1., self.n)
         # random correl
-        self.corr = genCorrel(self.n)
+        self.corr = genCorrel(self.n, rng)
 
         # random weights
-        self.a = np.random.uniform(low=1., high=10., size=self.n)
+        self.a = rng.uniform(low=1., high=10., size=self.n)
         self.a /= np.sum(self.a)
         # random vols
-        vols = np.random.uniform(low=5., high = 50., size = self.n)
+        vols = rng.uniform(low=5., high = 50., size = self.n)
         # normalize vols for a given volatility of basket, 
         # helps with charts without loss of generality
         avols = (self.a * vols).reshape((-1,1))
@@ -211,57 +431,210 @@ class Bachelier:
         self.chol = np.linalg.cholesky(self.cov) * np.sqrt(self.T2 - self.T1)
         # increase vols for simulation of X so we have more samples in the wings
         self.chol0 = self.chol * self.volMult * np.sqrt(self.T1 / (self.T2 - self.T1))
-        # simulations
-        normals = np.random.normal(size=[2, m, self.n])
-        inc0 = normals[0, :, :] @ self.chol0.T
-        inc1 = normals[1, :, :] @ self.chol.T
-    
-        S1 = self.S0 + inc0
-        
-        S2 = S1 + inc1
-        bkt2 = np.dot(S2, self.a)
-        pay = np.maximum(0, bkt2 - self.K)
+
+    # rescales vols and Choleski factors of the current market to a new basket vol,
+    # correlation and weights are kept, no new factorisation required
+    def _rescaleMarket(self, bktVol):
+
+        scale = bktVol / self.bktVol
+        self.vols = self.vols * scale
+        self.bktVol = bktVol
+        self.cov = self.cov * scale * scale
+        self.chol = self.chol * scale
+        self.chol0 = self.chol0 * scale
+
+    # consumes the random numbers of _setupMarket without changing the market
+    def _skipMarket(self, rng):
+
+        rng.uniform(low=-1., high=1., size=(2*self.n, self.n))
+        rng.uniform(low=1., high=10., size=self.n)
+        rng.uniform(low=5., high = 50., size = self.n)
+
+    # market for the next draw: cached market, rescaled if the basket vol differs,
+    # a new random market drawn from rng on first use
+    # seeded: rng is new from the seed of the call, the market draws are skipped on a cached market, 
+    # so the paths of a seed are the same whether the market was drawn in this call or before
+    def _market(self, rng, bktVol, seeded=False):
+
+        if self.chol is None:
+            self._setupMarket(rng, bktVol)
+            return
+        if seeded:
+            self._skipMarket(rng)
+        if bktVol != self.bktVol:
+            self._rescaleMarket(bktVol)
+
+    # rng for a draw and whether it is new from the seed (no rng in the call or on the instance)
+    def _seededRng(self, seed=None, rng=None):
+        return self._rng(seed, rng), rng is None and self.rng is None
+
+    # draws a new random market for all later training and test sets
+    def calibrate(self, seed=None, bktVol=0.2, rng=None):
+
+        self._setupMarket(self._rng(seed, rng), bktVol)
+        return self
+
+    # simulates a block of paths in the current market from 
+    # independent standard normals (kxn) for [0,T1] and [T1,T2]
+    # the differentials are rank one, Z = w * a with weights w (kx1), 
+    # denseZ=False returns S1 (kxn), C2 (kx1), w (kx1) and a (n) instead of Z (kxn)
+    # rowwise: every path independent of the number of paths k in the block, see _rowProducts
+    def _paths(self, normals0, normals1, anti=True, denseZ=True, rowwise=False):
+
+        # market in the output precision
+        S0, a, chol0, chol = [x.astype(self.dtype, copy=False) for x in (self.S0, self.a, self.chol0, self.chol)]
+
+        S1 = _rowProducts(normals0, chol0, rowwise)
+        S1 += S0
+
+        # only the baskets are required at T2, the increment of the basket is 
+        # inc1 @ a = normals1 @ (chol.T @ a), no (kxn) paths S2, S2a are formed
+        bkt1 = _rowProducts(S1, a, rowwise)
+        dbkt = _rowProducts(normals1, chol.T @ a, rowwise)
+        bkt2 = bkt1 + dbkt
 
         # two antithetic paths
         if anti:
             
-            S2a = S1 - inc1
-            bkt2a = np.dot(S2a, self.a)
-            paya = np.maximum(0, bkt2a - self.K)
+            bkt2a = bkt1
+            bkt2a -= dbkt
             
             X = S1
-            Y = 0.5 * (pay + paya)
+            Y = 0.5 * (np.maximum(bkt2 - self.K, 0) + np.maximum(bkt2a - self.K, 0))
     
             # differentials
-            Z1 =  np.where(bkt2 > self.K, 1.0, 0.0).reshape((-1,1)) * self.a.reshape((1,-1))
-            Z2 =  np.where(bkt2a > self.K, 1.0, 0.0).reshape((-1,1)) * self.a.reshape((1,-1))
-            Z = 0.5 * (Z1 + Z2)
+            w = 0.5 * ((bkt2 > self.K).astype(self.dtype) + (bkt2a > self.K).astype(self.dtype))
                     
         # standard
         else:
         
             X = S1
-            Y = pay
+            Y = np.maximum(bkt2 - self.K, 0)
             
             # differentials
-            Z =  np.where(bkt2 > self.K, 1.0, 0.0).reshape((-1,1)) * self.a.reshape((1,-1))
-            
+            w = (bkt2 > self.K).astype(self.dtype)
+
+        if not denseZ:
+            return X, Y.reshape(-1,1), w.reshape(-1,1), a
+        
+        Z = w.reshape((-1,1)) * a.reshape((1,-1))
         return X, Y.reshape(-1,1), Z
+
+    # second-order labels for spots S1 (kxn) and normals (kxn) over [T1,T2], likelihood ratio on the 
+    # pathwise delta: d2C2/dS1_i dS1_j = g * a_i * a_j with g = 1{B2>K} N/s with the basket B2 = B1 + s N, 
+    # an unbiased estimate of the gamma (the pathwise gamma of the payoff is zero)
+    # returns the diagonal g * a_i^2 (kxn), denseZ=False: g (kx1)
+    def _gammas(self, S1, normals1, anti=True, denseZ=True):
+
+        ca = self.chol.T @ self.a
+        s = float(np.sqrt(ca @ ca))
+        a = self.a.astype(self.dtype, copy=False)
+        bkt1 = S1 @ a
+        dbkt = normals1 @ ca.astype(self.dtype, copy=False)
+        score = dbkt / (s * s)
+
+        if anti:
+            g = 0.5 * ((bkt1 + dbkt > self.K).astype(self.dtype) - (bkt1 - dbkt > self.K).astype(self.dtype)) * score
+        else:
+            g = (bkt1 + dbkt > self.K).astype(self.dtype) * score
+
+        if not denseZ:
+            return g.reshape(-1,1)
+        return g.reshape((-1,1)) * (a * a).reshape((1,-1))
+
+    # training set: returns S1 (mxn), C2 (mx1) and dC2/dS1 (mxn)
+    # the market is drawn on the first call only, later calls (new seeds, more samples) 
+    # simulate in the same market and can be appended to earlier sets,
+    # the same seed gives the same set on every call, see _market
+    # qmc: normals from a scrambled Sobol sequence in 2n dimensions instead of pseudo random numbers
+    # denseZ=False: S1 (mxn), C2 (mx1), w (mx1) and a (n) with dC2/dS1 = w * a, see _paths
+    # gamma: also returns second-order labels, the diagonal d2C2/dS1_i^2 (mxn) or g (mx1), see _gammas
+    def trainingSet(self, m, anti=True, seed=None, bktVol=0.2, rng=None, qmc=False, denseZ=True, gamma=False):
+    
+        rng, seeded = self._seededRng(seed, rng)
+
+        self._market(rng, bktVol, seeded)
+
+        # simulations
+        if qmc:
+            normals = sobolNormals(sobolEngine(2 * self.n, rng), m, self.dtype)
+            normals0, normals1 = normals[:, :self.n], normals[:, self.n:]
+        else:
+            normals = _normals(rng, [2, m, self.n], self.dtype)
+            normals0, normals1 = normals[0, :, :], normals[1, :, :]
+
+        sets = self._paths(normals0, normals1, anti, denseZ)
+        if gamma:
+            return sets + (self._gammas(sets[0], normals1, anti, denseZ),)
+        return sets
+
+    # training set in chunks: iterator over S1 (kxn), C2 (kx1) and dC2/dS1 (kxn) 
+    # with k = chunkSize (the last chunk may be smaller) in the cached market,
+    # memory is bounded by the chunk size
+    # normals are drawn path by path and the paths are simulated row by row (see _rowProducts), 
+    # so for a given seed the concatenated chunks are bitwise the same for any chunk size
+    # (but differ from trainingSet which draws [2, m, n])
+    # qmc: chunks continue one scrambled Sobol sequence, also independent of the chunk size
+    # denseZ=False: chunks of S1, C2, w and a with dC2/dS1 = w * a, see _paths
+    def trainingSetChunks(self, m, chunkSize=65536, anti=True, seed=None, bktVol=0.2, rng=None, qmc=False, 
+                          denseZ=True):
+
+        rng, seeded = self._seededRng(seed, rng)
+
+        # market is set up eagerly, i.e. available to testSet before the first chunk
+        self._market(rng, bktVol, seeded)
+
+        engine = sobolEngine(2 * self.n, rng) if qmc else None
+
+        def chunks():
+            for start in range(0, m, chunkSize):
+                k = min(chunkSize, m - start)
+                if qmc:
+                    normals = sobolNormals(engine, k, self.dtype).reshape([k, 2, self.n])
+                else:
+                    normals = _normals(rng, [k, 2, self.n], self.dtype)
+                yield self._paths(normals[:, 0, :], normals[:, 1, :], anti, denseZ, rowwise=True)
+
+        return chunks()
+
+    # block of k paths for the parallel simulation, drawn from the generator rng
+    def _trainingSetBlock(self, rng, k, anti=True):
+
+        normals = _normals(rng, [k, 2, self.n], self.dtype)
+        return self._paths(normals[:, 0, :], normals[:, 1, :], anti)
+
+    # training set simulated on a pool of worker processes, see simulateParallel
+    # the market is set up in the calling process as in trainingSet
+    def trainingSetParallel(self, m, anti=True, seed=None, bktVol=0.2, workers=None, rng=None):
+
+        self._market(self._rng(seed, rng), bktVol)
+
+        return simulateParallel(self._trainingSetBlock, m, self.n, self.n, workers=workers, seed=seed, 
+                                bitGenerator=self.bitGenerator or 'PCG64', dtype=self.dtype, anti=anti)
     
     # test set: returns an array of independent, uniformly random spots 
     # with corresponding baskets, ground true prices, deltas and vegas
-    def testSet(self, lower=0.5, upper=1.50, num=4096, seed=None):
+    # qmc: spots from a scrambled Sobol sequence instead of pseudo random numbers
+    # gamma: also returns the diagonal gammas d2C/dS_i^2 (numxn)
+    def testSet(self, lower=0.5, upper=1.50, num=4096, seed=None, rng=None, qmc=False, gamma=False):
         
-        np.random.seed(seed)
+        rng = self._rng(seed, rng)
         # adjust lower and upper for dimension
         adj = 1 + 0.5 * np.sqrt((self.n-1)*(upper-lower)/12)
         adj_lower = 1.0 - (1.0-lower) * adj
         adj_upper = 1.0 + (upper - 1.0) * adj
         # draw spots
-        spots = np.random.uniform(low=adj_lower, high = adj_upper, size=(num, self.n))
+        if qmc:
+            spots = adj_lower + (adj_upper - adj_lower) * sobolEngine(self.n, rng).random(num)
+        else:
+            spots = rng.uniform(low=adj_lower, high = adj_upper, size=(num, self.n))
         # compute baskets, prices, deltas and vegas
         baskets = np.dot(spots, self.a).reshape((-1, 1))
-        prices = bachPrice(baskets, self.K, self.bktVol, self.T2 - self.T1).reshape((-1, 1))
-        deltas = bachDelta(baskets, self.K, self.bktVol, self.T2 - self.T1) @ self.a.reshape((1, -1))
-        vegas = bachVega(baskets, self.K, self.bktVol, self.T2 - self.T1) 
+        prices, deltas, vegas, gammas = bachGreeks(baskets, self.K, self.bktVol, self.T2 - self.T1)
+        deltas = deltas @ self.a.reshape((1, -1))
+        gammas = gammas @ (self.a * self.a).reshape((1, -1))
+        spots, baskets, prices, deltas, vegas, gammas = [x.astype(self.dtype, copy=False) 
+                                                         for x in (spots, baskets, prices, deltas, vegas, gammas)]
+        if gamma:
+            return spots, baskets, prices, deltas, vegas, gammas
         return spots, baskets, prices, deltas, vegas
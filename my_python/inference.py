@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Inference
+
+Low-latency evaluation of a trained model and its prep layer. `InferenceEngine` wraps pre-processing, model and post-processing in one `tf.function` with a fixed input signature, i.e. a call is a single graph execution without the set-up of the Keras predict loop. `BatchingEngine` coalesces concurrent small requests (threads or asyncio) into one engine call.
+
+    engine = InferenceEngine(model, prep_layer, input_dim)
+    y, dydx = engine.predict(x)
+
+    with BatchingEngine(engine) as server:
+        y, dydx = server.predict(x)             # from any thread
+        y, dydx = await server.apredict(x)      # from a coroutine
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+import tensorflow as tf
+
+class InferenceEngine:
+
+    def __init__(self, model, prep_layer, input_dim, dtype=tf.float32):
+        self.model = model
+        self.prep_layer = prep_layer
+        self.input_dim = input_dim
+        self.dtype = dtype
+        self._predict = tf.function(
+            self._unscaled,
+            input_signature=[tf.TensorSpec(shape=[None, input_dim], dtype=dtype)])
+
+    # raw inputs to unscaled price (kx1) and delta (kxn), traced once
+    def _unscaled(self, x):
+        y_scaled, dydx_scaled = self.model(self.prep_layer(x), training=False)
+        y_pred = self.prep_layer.yScaledInverse(y_scaled)
+        dydx_pred = self.prep_layer.dydxScaledInverse(dydx_scaled)
+        return tf.reshape(y_pred, [-1, 1]), dydx_pred
+
+    # same results as predict_unscaled for arrays (kxn)
+    def predict(self, x):
+        y_pred, dydx_pred = self._predict(tf.convert_to_tensor(x, dtype=self.dtype))
+        return y_pred.numpy(), dydx_pred.numpy()
+
+class BatchingEngine:
+
+    # requests are collected until max_batch rows or max_delay seconds after the first request
+    def __init__(self, engine, max_batch=4096, max_delay=0.0002):
+        self.engine = engine
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._requests = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(target=self._serve, name='BatchingEngine', daemon=True)
+        self._worker.start()
+
+    # future of (price, delta) for inputs x (kxn), RuntimeError after close
+    def submit(self, x):
+        x = np.asarray(x, dtype=np.float32).reshape(-1, self.engine.input_dim)
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('BatchingEngine is closed')
+            self._requests.put((x, future))
+        return future
+
+    def predict(self, x):
+        return self.submit(x).result()
+
+    async def apredict(self, x):
+        return await asyncio.wrap_future(self.submit(x))
+
+    # serves the requests submitted before, later submits raise
+    def close(self):
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._requests.put(None)
+        self._worker.join()
+        # requests the worker did not serve (it stopped on an error) fail instead of waiting forever
+        while True:
+            try:
+                request = self._requests.get_nowait()
+            except queue.Empty:
+                return
+            if request is not None and request[1].set_running_or_notify_cancel():
+                request[1].set_exception(RuntimeError('BatchingEngine is closed'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _serve(self):
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            batch = [request]
+            rows = len(request[0])
+            deadline = time.perf_counter() + self.max_delay
+            closing = False
+            while rows < self.max_batch:
+                try:
+                    request = self._requests.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                batch.append(request)
+                rows += len(request[0])
+            self._run(batch)
+            if closing:
+                return
+
+    # one engine call for the batch, results split back to the requests,
+    # requests cancelled while queued are dropped
+    def _run(self, batch):
+        batch = [(x, future) for x, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            y_pred, dydx_pred = self.engine.predict(np.concatenate([x for x, _ in batch]))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        start = 0
+        for x, future in batch:
+            stop = start + len(x)
+            future.set_result((y_pred[start:stop], dydx_pred[start:stop]))
+            start = stop
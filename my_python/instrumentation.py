@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""Training instrumentation
+
+Keras callbacks for long training runs:
+
+- `TrainingMonitor` times every training step and reports per epoch the step latency percentiles (p50, p90, p99, max), the epoch time, samples/s, the time split of the model between the forward branch (y_pred) and the derivative branch (dydx_pred) measured on a probe batch, the resident set size and, where the device tracks it, the tensor memory. The first step of the run (tracing) is reported separately and left out of the percentiles.
+- `ProfilerWindow` runs the TensorFlow profiler for a window of global steps, e.g. after warm-up.
+
+Metrics go to TensorBoard scalars and to a JSON lines file with one record per epoch and a final summary record, in the layout of `tensorboard_logs`:
+
+    tensorboard_logs/pca/ADPCA_10/train/              # Keras and timing scalars, plugins/profile
+    tensorboard_logs/pca/ADPCA_10/validation/
+    tensorboard_logs/pca/ADPCA_10/metrics.jsonl
+
+    history = models.train_model(model, prep_layer, 'pca/ADPCA_10', x, y, dydx,
+                                 log_dir='tensorboard_logs', profile_steps=(20, 30))
+
+`train_model` attaches the callbacks when it is given a `log_dir`, `training_callbacks` returns them for use with `model.fit`.
+"""
+
+import importlib.util
+import json
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+from my_python.memory import rss
+
+METRICS_FILE = 'metrics.jsonl'
+PERCENTILES = (50, 90, 99)
+
+# tf.summary needs the tensorboard package, without it only the metrics file is written
+def tensorboard_available():
+    return importlib.util.find_spec('tensorboard') is not None
+
+# current and peak tensor memory in bytes of the first GPU, or the CPU,
+# None if the allocator keeps no statistics (the default CPU allocator reports zeros)
+def tensor_memory():
+    device = 'GPU:0' if tf.config.list_logical_devices('GPU') else 'CPU:0'
+    try:
+        info = tf.config.experimental.get_memory_info(device)
+    except (ValueError, tf.errors.OpError):
+        return None
+    return info if info['current'] or info['peak'] else None
+
+def _reset_tensor_peak():
+    device = 'GPU:0' if tf.config.list_logical_devices('GPU') else 'CPU:0'
+    try:
+        tf.config.experimental.reset_memory_stats(device)
+    except (ValueError, tf.errors.OpError):
+        pass
+
+def _latency_stats(prefix, seconds):
+    if len(seconds) == 0:
+        return {}
+    ms = 1000.0 * np.asarray(seconds)
+    stats = {'%s_p%d' % (prefix, q): float(v) for q, v in zip(PERCENTILES, np.percentile(ms, PERCENTILES))}
+    stats[prefix + '_mean'] = float(ms.mean())
+    stats[prefix + '_max'] = float(ms.max())
+    return stats
+
+# best time of repeats of fn(x) after a warm-up call
+def _best_time(fn, x, repeats):
+    fn(x)
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(x)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+class TrainingMonitor(keras.callbacks.Callback):
+
+    # log_dir: run directory, e.g. tensorboard_logs/pca/ADPCA_10, None keeps the records in memory only,
+    # batch_size: samples per step (global batch size in distributed training),
+    # samples_per_epoch: if the last batch of an epoch is partial, defaults to steps * batch_size,
+    # probe_every: epochs between timings of the forward and derivative branches, 0 switches them off
+    def __init__(self, log_dir=None, batch_size=None, samples_per_epoch=None, probe_every=1, probe_repeats=3):
+        super().__init__()
+        self.log_dir = log_dir
+        self.batch_size = batch_size
+        self.samples_per_epoch = samples_per_epoch
+        self.probe_every = probe_every
+        self.probe_repeats = probe_repeats
+        self.records = []
+        self.summary = None
+
+    def on_train_begin(self, logs=None):
+        self.global_step = 0
+        self.first_step = None
+        self.step_times = []
+        self.epoch_times = []
+        self.rss_start = rss()
+        self._probes = None
+        self._writer = None
+        self._file = None
+        if self.log_dir is not None:
+            os.makedirs(self.log_dir, exist_ok=True)
+            if tensorboard_available():
+                self._writer = tf.summary.create_file_writer(os.path.join(self.log_dir, 'train'))
+            self._file = open(os.path.join(self.log_dir, METRICS_FILE), 'a')
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+        self._epoch_steps = []
+        self._steps = 0
+        self._first_batch = None
+        _reset_tensor_peak()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._step_start = time.perf_counter()
+        if self._first_batch is None:
+            self._first_batch = self._step_start
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._last_batch = time.perf_counter()
+        seconds = self._last_batch - self._step_start
+        # the first step traces the train function
+        if self.global_step == 0:
+            self.first_step = seconds
+        else:
+            self._epoch_steps.append(seconds)
+        self.global_step += 1
+        self._steps += 1
+
+    # forward (y_pred) and full model (y_pred and dydx_pred) on a batch of normal inputs,
+    # None for models without both outputs
+    def _probe_functions(self):
+        model = self.model
+        if not {'y_pred', 'dydx_pred'} <= set(model.output_names):
+            return None
+        outputs = dict(zip(model.output_names, model.outputs))
+        forward = keras.Model(model.inputs, outputs['y_pred'])
+        full = keras.Model(model.inputs, [outputs['y_pred'], outputs['dydx_pred']])
+        x = tf.random.normal((self.batch_size or 1024, model.inputs[0].shape[-1]))
+        return (tf.function(lambda x: forward(x, training=False)),
+                tf.function(lambda x: full(x, training=False)), x)
+
+    def _probe(self):
+        if self._probes is None:
+            self._probes = self._probe_functions() or False
+        if not self._probes:
+            return {}
+        forward, full, x = self._probes
+        forward_time = _best_time(forward, x, self.probe_repeats)
+        full_time = _best_time(full, x, self.probe_repeats)
+        return {'forward_ms': 1000.0 * forward_time, 'derivative_ms': 1000.0 * max(full_time - forward_time, 0.0)}
+
+    def on_epoch_end(self, epoch, logs=None):
+
+        epoch_seconds = time.perf_counter() - self._epoch_start
+        steps = self._steps
+        train_seconds = self._last_batch - self._first_batch if self._first_batch is not None else 0.0
+        samples = self.samples_per_epoch or (steps * self.batch_size if self.batch_size else None)
+        self.step_times.extend(self._epoch_steps)
+        self.epoch_times.append(epoch_seconds)
+
+        record = {'epoch': epoch, 'step': self.global_step, 'steps': steps,
+                  'epoch_seconds': epoch_seconds, 'train_seconds': train_seconds}
+        record.update(_latency_stats('step_ms', self._epoch_steps))
+        if samples and train_seconds > 0:
+            record['samples_per_second'] = samples / train_seconds
+
+        # the rest of a step: loss, backpropagation to the weights and optimizer update
+        if self.probe_every and epoch % self.probe_every == 0:
+            record.update(self._probe())
+            if 'forward_ms' in record and 'step_ms_p50' in record:
+                record['update_ms'] = max(record['step_ms_p50'] - record['forward_ms'] - record['derivative_ms'], 0.0)
+
+        current = rss()
+        record['rss_mb'] = current / 2**20
+        record['rss_growth_mb'] = (current - self.rss_start) / 2**20
+        memory = tensor_memory()
+        if memory is not None:
+            record['tensor_mb'] = memory['current'] / 2**20
+            record['tensor_peak_mb'] = memory['peak'] / 2**20
+
+        self._write_scalars(record, epoch)
+        record.update({key: float(value) for key, value in (logs or {}).items()})
+        self.records.append(record)
+        if self._file is not None:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+
+    def on_train_end(self, logs=None):
+        self.summary = {'summary': True, 'epochs': len(self.epoch_times), 'steps': self.global_step,
+                        'first_step_ms': None if self.first_step is None else 1000.0 * self.first_step}
+        self.summary.update(_latency_stats('step_ms', self.step_times))
+        self.summary.update(_latency_stats('epoch_ms', self.epoch_times))
+        rates = [record['samples_per_second'] for record in self.records if 'samples_per_second' in record]
+        if rates:
+            self.summary['samples_per_second'] = float(np.median(rates))
+        self.summary['rss_growth_mb'] = (rss() - self.rss_start) / 2**20
+        if self._file is not None:
+            self._file.write(json.dumps(self.summary) + '\n')
+            self._file.close()
+            self._file = None
+        if self._writer is not None:
+            self._writer.close()
+
+    # losses and metrics are written by the TensorBoard callback
+    def _write_scalars(self, record, epoch):
+        if self._writer is None:
+            return
+        with self._writer.as_default():
+            for key, value in record.items():
+                if key not in ('epoch', 'step', 'steps'):
+                    tf.summary.scalar('instrumentation/' + key, value, step=epoch)
+        self._writer.flush()
+
+class ProfilerWindow(keras.callbacks.Callback):
+
+    # profiles the global training steps start <= step < stop into log_dir/plugins/profile
+    def __init__(self, log_dir, steps=(10, 20)):
+        super().__init__()
+        self.log_dir = log_dir
+        self.start, self.stop = steps
+        self.active = False
+
+    def on_train_begin(self, logs=None):
+        self.global_step = 0
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.global_step == self.start and not self.active:
+            tf.profiler.experimental.start(self.log_dir)
+            self.active = True
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.global_step += 1
+        if self.active and self.global_step >= self.stop:
+            self._stop()
+
+    def on_train_end(self, logs=None):
+        if self.active:
+            self._stop()
+
+    def _stop(self):
+        tf.profiler.experimental.stop()
+        self.active = False
+
+# TensorBoard (if installed), TrainingMonitor and, for profile_steps=(start, stop), ProfilerWindow on the run directory
+def training_callbacks(run_dir, batch_size=None, profile_steps=None, samples_per_epoch=None, probe_every=1):
+    callbacks = [TrainingMonitor(run_dir, batch_size, samples_per_epoch, probe_every)]
+    if tensorboard_available():
+        callbacks.insert(0, keras.callbacks.TensorBoard(log_dir=run_dir, profile_batch=0))
+    if profile_steps is not None:
+        callbacks.append(ProfilerWindow(os.path.join(run_dir, 'train'), profile_steps))
+    return callbacks
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""Process memory
+
+Resident set size of the process and its peak over a block, shared by the benchmarks and the training instrumentation.
+
+    with PeakMemory() as memory:
+        x, y, dydx = generator.trainingSet(2**20, seed=1234)
+    print(memory.peak / 2**20, 'MB')
+"""
+
+import os
+import sys
+import threading
+
+# resident set size in bytes
+def rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        # peak instead of current outside Linux, kB on Linux and bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+class PeakMemory:
+
+    # samples the resident set size in a thread, peak above the level at entry
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.peak = 0
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss() - self.start)
+
+    def __enter__(self):
+        self.start = rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss() - self.start)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Sweeps
+
+Runs grids of training configurations (model, pre-processing, differential weight, learning rate schedule, sample size and seed) concurrently in a process pool, e.g. the impact of sample size or the comparison of twin net, autodiff and autoencoders. Every worker process runs one configuration at a time with a limited number of TensorFlow threads. Finished runs are checkpointed as one JSON file per run, i.e. an interrupted sweep resumes with the missing runs, and the validation metrics are collected into one results table.
+
+    generator = Bachelier(10).calibrate(seed=1234)
+    sweep = Sweep('sweeps/basket_10', generator, test_kwargs={'num': 4096, 'seed': 4321})
+    configs = grid(model=['get_model_twin_net', 'get_model_autodiff_AE8'], prep_type=['PCA'],
+                   size=[1024, 8192, 65536], seed=[1, 2, 3])
+    rows = sweep.run(configs, workers=16, threads=2)
+    sweep.to_csv('sweeps/basket_10/results.csv')
+
+Workers are started with `spawn` and import TensorFlow themselves, the generator is passed by pickling. Models are given by the name of their getter in `my_python.models` and schedules by name (`lr_warmup`, `lr_inv_time_decay`) or as a callable returning a schedule, defined at module level: runs are keyed on its module and name (see `cache.key_repr`), i.e. a resumed sweep finds them in any process.
+"""
+
+import csv
+import itertools
+import json
+import os
+import pathlib
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing as mp
+
+import numpy as np
+
+from my_python.cache import cache_key, key_repr
+
+# defaults of the configuration keys
+DEFAULTS = {
+    'model': 'get_model_twin_net',
+    'prep_type': 'Normalisation',
+    'differential_weight': 1,
+    'alpha': None,
+    'lr_schedule': 'lr_warmup',
+    'size': 8192,
+    'seed': 0
+}
+
+RUNS_DIR = 'runs'
+
+# configurations of the cartesian product of the axes, e.g. grid(size=[1024, 8192], seed=[1, 2])
+def grid(**axes):
+    keys = list(axes)
+    return [dict(zip(keys, values)) for values in itertools.product(*(axes[key] for key in keys))]
+
+# thread limits of a worker, before TensorFlow is initialised
+def _init_worker(threads):
+    for var in ('OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS'):
+        os.environ[var] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+def _lr_schedule(lr_schedule, models):
+    if lr_schedule is None or isinstance(lr_schedule, str):
+        return getattr(models, lr_schedule or 'lr_warmup')
+    return lr_schedule()
+
+# trains one configuration and returns its row of the results table
+def run_config(generator, config, test_kwargs=None, train_method='trainingSet', train_kwargs=None,
+               epochs=None, batch_size=None, cache=None):
+
+    import tensorflow as tf
+    from my_python import models
+
+    config = {**DEFAULTS, **config}
+    epochs = models.EPOCHS if epochs is None else epochs
+    batch_size = models.BATCH_SIZE if batch_size is None else batch_size
+    tf.keras.utils.set_random_seed(config['seed'])
+
+    # data, training set from the cache if given
+    start = time.perf_counter()
+    draw = cache or (lambda generator, method, *args, **kwargs: getattr(generator, method)(*args, **kwargs))
+    x_train, y_train, dydx_train = draw(generator, train_method, config['size'], seed=config['seed'], **(train_kwargs or {}))
+    x_true, _, y_true, dydx_true, _ = generator.testSet(**(test_kwargs or {}))
+    y_true = y_true.reshape(-1, 1)
+    data_time = time.perf_counter() - start
+
+    # model
+    prep_layer, scaled_MSE = models.preprocess_data(x_train, y_train, dydx_train, config['prep_type'])
+    model = models.build_and_compile_model(
+        prep_layer.output_n(),
+        getattr(models, config['model']),
+        scaled_MSE,
+        differential_weight=config['differential_weight'],
+        lr_schedule=_lr_schedule(config['lr_schedule'], models),
+        alpha=config['alpha'])
+
+    start = time.perf_counter()
+    history = models.train_model(model, prep_layer, None, x_train, y_train, dydx_train,
+                                 epochs=epochs, batch_size=batch_size,
+                                 x_true=x_true, y_true=y_true, dydx_true=dydx_true, progress=False)
+    train_time = time.perf_counter() - start
+
+    # validation metrics on unscaled prices and deltas
+    y_pred, dydx_pred = models.predict_unscaled(model, prep_layer, x_true, verbose=0)
+    epochs_run = len(history.history['loss'])
+    return {
+        **{key: value if isinstance(value, (bool, int, float, str)) or value is None else key_repr(value)
+           for key, value in config.items()},
+        'epochs': epochs_run,
+        'loss': float(history.history['loss'][-1]),
+        'val_loss': float(history.history['val_loss'][-1]),
+        'rmse_price': float(np.sqrt(np.mean((y_pred - y_true) ** 2))),
+        'rmse_delta': float(np.sqrt(np.mean((dydx_pred - dydx_true) ** 2))),
+        'data_time': data_time,
+        'train_time': train_time,
+        'samples_per_second': config['size'] * epochs_run / train_time,
+        'pid': os.getpid()
+    }
+
+class Sweep:
+
+    def __init__(self, path, generator, test_kwargs=None, train_method='trainingSet', train_kwargs=None,
+                 epochs=None, batch_size=None, cache=None):
+
+        # the test set and all training sets must come from one market
+        if hasattr(generator, 'calibrate') and getattr(generator, 'chol', None) is None:
+            raise ValueError("calibrate the generator before the sweep, e.g. generator.calibrate(seed=1234)")
+        # runs are keyed on seeds, a stateful rng would make them irreproducible
+        if getattr(generator, 'rng', None) is not None:
+            raise ValueError("the generator of a sweep must draw from seeds, not from an rng")
+        self.path = pathlib.Path(path)
+        (self.path / RUNS_DIR).mkdir(parents=True, exist_ok=True)
+        self.generator = generator
+        self.test_kwargs = test_kwargs or {}
+        self.train_method = train_method
+        self.train_kwargs = train_kwargs or {}
+        self.epochs = epochs
+        self.batch_size = batch_size
+        self.cache = cache
+
+    # checkpoint key of a configuration, depends on the generator and all settings of the sweep
+    def key(self, config):
+        settings = {'test_kwargs': self.test_kwargs, 'train_method': self.train_method,
+                    'train_kwargs': self.train_kwargs, 'epochs': self.epochs, 'batch_size': self.batch_size}
+        return cache_key(self.generator, 'sweep', (), {**DEFAULTS, **config, **settings})
+
+    def _run_path(self, config):
+        return self.path / RUNS_DIR / (self.key(config) + '.json')
+
+    def done(self, config):
+        return self._run_path(config).is_file()
+
+    # written to a temporary file and renamed, an interrupted sweep never leaves partial runs
+    def _checkpoint(self, config, row):
+        fd, tmp = tempfile.mkstemp(dir=self.path / RUNS_DIR, prefix='.tmp-', suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(row, f, indent=2)
+        os.replace(tmp, self._run_path(config))
+
+    # runs the configurations not yet done, threads: TensorFlow threads per worker,
+    # workers: defaults to all cores at the given threads per worker, 0 runs in this process
+    def run(self, configs, workers=None, threads=1):
+
+        todo = [config for config in configs if not self.done(config)]
+        if workers is None:
+            workers = max(1, (os.cpu_count() or 1) // threads)
+        args = (self.test_kwargs, self.train_method, self.train_kwargs, self.epochs, self.batch_size, self.cache)
+
+        if workers == 0:
+            for config in todo:
+                self._checkpoint(config, run_config(self.generator, config, *args))
+        elif todo:
+            with ProcessPoolExecutor(max_workers=min(workers, len(todo)),
+                                     mp_context=mp.get_context('spawn'),
+                                     initializer=_init_worker, initargs=(threads,)) as pool:
+                futures = {pool.submit(run_config, self.generator, config, *args): config for config in todo}
+                for future in as_completed(futures):
+                    self._checkpoint(futures[future], future.result())
+
+        return self.results(configs)
+
+    # rows of the finished runs, of the given configurations or all
+    def results(self, configs=None):
+        if configs is None:
+            paths = sorted((self.path / RUNS_DIR).glob('[!.]*.json'))
+        else:
+            paths = [self._run_path(config) for config in configs if self.done(config)]
+        rows = []
+        for path in paths:
+            with open(path) as f:
+                rows.append(json.load(f))
+        return rows
+
+    def to_csv(self, path, configs=None):
+        rows = self.results(configs)
+        columns = list(dict.fromkeys(key for row in rows for key in row))
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+        return rows